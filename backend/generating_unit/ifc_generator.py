@@ -1,39 +1,105 @@
 import ifcopenshell
 import ifcopenshell.api
 import ifcopenshell.guid
-import time
-import uuid
+import logging
+import math
+import numpy as np
+import os
+import threading
+
+logger = logging.getLogger("mcc.ifc")
 
 class IfcGenerator:
+    # Serialized Project -> Site -> Building -> Storey skeleton, built once per process
+    # and cloned for every new model instead of replaying the api calls each time.
+    _template = None
+    _template_lock = threading.Lock()
+
     def __init__(self, project_name="ConstructionProject"):
+        self.model = ifcopenshell.file.from_string(self._skeleton())
+
+        # Rebind the hierarchy from the cloned skeleton
+        self.project = self.model.by_type("IfcProject")[0]
+        self.project.Name = project_name
+        self.context = self.model.by_type("IfcGeometricRepresentationContext", include_subtypes=False)[0]
+        self.body_context = self.model.by_type("IfcGeometricRepresentationSubContext")[0]
+        self.material = self.model.by_type("IfcMaterial")[0]
+        self.site = self.model.by_type("IfcSite")[0]
+        self.building = self.model.by_type("IfcBuilding")[0]
+        self.storey = self.model.by_type("IfcBuildingStorey")[0]
+
+        # GlobalIds are drawn from a pool filled in bulk, see _reserve_guids
+        self._guid_pool = []
+
+        # The clone carries the template's GlobalIds, every model needs its own
+        roots = self.model.by_type("IfcRoot")
+        self._reserve_guids(len(roots))
+        for root in roots:
+            root.GlobalId = self._new_guid()
+        
+        # Shared geometry primitives reused by every element
+        self._z_dir = self.model.createIfcDirection((0.0, 0.0, 1.0))
+        self._origin_placement = self.model.createIfcAxis2Placement3D(
+            self.model.createIfcCartesianPoint((0.0, 0.0, 0.0)), None, None)
+
+        # Profiles and shapes are deduplicated by their rounded dimensions so that
+        # identical elements (e.g. the same column on every floor) share geometry.
+        self._profile_cache = {}
+        self._solid_cache = {}
+        self._shape_cache = {}
+        # Floor stacks instance one representation map per size at fixed Z offsets
+        self._map_cache = {}
+        self._offset_cache = {}
+
+        # Elements awaiting containment in the storey and material association.
+        # Both relationships are emitted once per batch instead of once per element.
+        self._pending_products = []
+        self._containment_rel = None
+        self._material_rel = None
+
+        logger.info("IFC Hierarchy initialized (IFC4): Project -> Site -> Building -> Storey")
+
+    @classmethod
+    def _skeleton(cls) -> str:
+        """
+        Return the serialized skeleton model, building it on first use.
+        """
+        with cls._template_lock:
+            if cls._template is None:
+                cls._template = cls._build_skeleton().to_string()
+        return cls._template
+
+    @staticmethod
+    def _build_skeleton():
+        """
+        Build the empty project hierarchy shared by every generated model.
+        """
         # Create a blank model with IFC4 schema for better compatibility with modern viewers
-        self.model = ifcopenshell.file(schema="IFC4")
+        model = ifcopenshell.file(schema="IFC4")
         
         # Create Project hierarchy
-        self.project = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcProject", name=project_name)
+        project = ifcopenshell.api.run("root.create_entity", model, ifc_class="IfcProject", name="ConstructionProject")
         
-        # Default units (SI)
-        ifcopenshell.api.run("unit.assign_unit", self.model)
+        # SI units in metres, matching the raw metre values written by the entity builders
+        ifcopenshell.api.run("unit.assign_unit", model, length={"is_metric": True, "raw": "METERS"})
         
         # Create context with explicit coordinate system
-        self.context = ifcopenshell.api.run("context.add_context", self.model, context_type="Model")
+        context = ifcopenshell.api.run("context.add_context", model, context_type="Model")
         
         # Create Body context for geometry
-        self.body_context = ifcopenshell.api.run("context.add_context", self.model, context_type="Model", 
-                                                 context_identifier="Body", target_view="MODEL_VIEW", parent=self.context)
+        ifcopenshell.api.run("context.add_context", model, context_type="Model", 
+                             context_identifier="Body", target_view="MODEL_VIEW", parent=context)
 
         # Add a default material
-        self.material = ifcopenshell.api.run("material.add_material", self.model, name="Concrete")
-        self.material_set = ifcopenshell.api.run("material.assign_material", self.model, 
-                                                 products=[], type="IFCMATERIALLAYERSET", material=self.material)
+        ifcopenshell.api.run("material.add_material", model, name="Concrete")
 
         # Create Site, Building, Storey
-        self.site = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcSite", name="MySite")
-        self.building = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcBuilding", name="MyBuilding")
-        self.storey = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcBuildingStorey", name="Level 1")
+        site = ifcopenshell.api.run("root.create_entity", model, ifc_class="IfcSite", name="MySite")
+        building = ifcopenshell.api.run("root.create_entity", model, ifc_class="IfcBuilding", name="MyBuilding")
+        storey = ifcopenshell.api.run("root.create_entity", model, ifc_class="IfcBuildingStorey", name="Level 1")
         
         # Set Storey Elevation
-        self.storey.Elevation = 0.0
+        storey.Elevation = 0.0
 
         # Reset all spatial placements to identity
         identity_matrix = [
@@ -42,179 +108,256 @@ class IfcGenerator:
             [0.0, 0.0, 1.0, 0.0],
             [0.0, 0.0, 0.0, 1.0]
         ]
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=self.site, matrix=identity_matrix)
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=self.building, matrix=identity_matrix)
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=self.storey, matrix=identity_matrix)
+        ifcopenshell.api.run("geometry.edit_object_placement", model, product=site, matrix=identity_matrix)
+        ifcopenshell.api.run("geometry.edit_object_placement", model, product=building, matrix=identity_matrix)
+        ifcopenshell.api.run("geometry.edit_object_placement", model, product=storey, matrix=identity_matrix)
 
         # Assign hierarchy
-        ifcopenshell.api.run("aggregate.assign_object", self.model, relating_object=self.project, products=[self.site])
-        ifcopenshell.api.run("aggregate.assign_object", self.model, relating_object=self.site, products=[self.building])
-        ifcopenshell.api.run("aggregate.assign_object", self.model, relating_object=self.building, products=[self.storey])
-        
-        print(f"IFC Hierarchy initialized (IFC4): Project -> Site -> Building -> Storey")
+        ifcopenshell.api.run("aggregate.assign_object", model, relating_object=project, products=[site])
+        ifcopenshell.api.run("aggregate.assign_object", model, relating_object=site, products=[building])
+        ifcopenshell.api.run("aggregate.assign_object", model, relating_object=building, products=[storey])
+        return model
+
+    def _reserve_guids(self, count: int):
+        """
+        Top up the GlobalId pool with `count` ids from a single urandom read.
+        """
+        if count <= 0:
+            return
+        raw = os.urandom(16 * count).hex()
+        self._guid_pool.extend(ifcopenshell.guid.compress(raw[i:i + 32]) for i in range(0, len(raw), 32))
+
+    def _new_guid(self) -> str:
+        """
+        Take the next GlobalId from the pool, falling back to a fresh one when it is empty.
+        """
+        if self._guid_pool:
+            return self._guid_pool.pop()
+        return ifcopenshell.guid.new()
+
+    def _local_placement(self, x: float, y: float, z: float, direction=None):
+        """
+        Build an IfcLocalPlacement at (x, y, z) relative to the storey.
+        `direction` is an optional normalized (dx, dy) for the local X axis.
+        """
+        location = self.model.createIfcCartesianPoint((float(x), float(y), float(z)))
+        if direction is None:
+            relative = self.model.createIfcAxis2Placement3D(location, None, None)
+        else:
+            ref_direction = self.model.createIfcDirection((float(direction[0]), float(direction[1]), 0.0))
+            relative = self.model.createIfcAxis2Placement3D(location, self._z_dir, ref_direction)
+        return self.model.createIfcLocalPlacement(self.storey.ObjectPlacement, relative)
+
+    def _rectangle_profile(self, x_dim: float, y_dim: float):
+        """
+        Return a shared IfcRectangleProfileDef for the given dimensions.
+        """
+        key = (round(x_dim, 4), round(y_dim, 4))
+        profile = self._profile_cache.get(key)
+        if profile is None:
+            profile = self.model.createIfcRectangleProfileDef(ProfileType="AREA", XDim=float(x_dim), YDim=float(y_dim))
+            self._profile_cache[key] = profile
+        return profile
+
+    def _rectangle_solid(self, x_dim: float, y_dim: float, depth: float):
+        """
+        Return a shared IfcExtrudedAreaSolid extruding an (x_dim, y_dim) rectangle along Z by `depth`.
+        """
+        key = (round(x_dim, 4), round(y_dim, 4), round(depth, 4))
+        solid = self._solid_cache.get(key)
+        if solid is None:
+            profile = self._rectangle_profile(x_dim, y_dim)
+            solid = self.model.createIfcExtrudedAreaSolid(profile, self._origin_placement, self._z_dir, float(depth))
+            self._solid_cache[key] = solid
+        return solid
+
+    def _rectangle_shape(self, x_dim: float, y_dim: float, depth: float):
+        """
+        Return a shared Body representation of the rectangle extrusion.
+        """
+        key = (round(x_dim, 4), round(y_dim, 4), round(depth, 4))
+        shape = self._shape_cache.get(key)
+        if shape is None:
+            representation = self.model.createIfcShapeRepresentation(
+                self.body_context, "Body", "SweptSolid", [self._rectangle_solid(x_dim, y_dim, depth)])
+            shape = self.model.createIfcProductDefinitionShape(None, None, [representation])
+            self._shape_cache[key] = shape
+        return shape
 
-    def create_column(self, x: float, y: float, width: float, depth: float, height: float, elevation: float = 0.0):
+    def _representation_map(self, x_dim: float, y_dim: float, depth: float):
+        """
+        Return a shared IfcRepresentationMap of the rectangle extrusion, for use in IfcMappedItem.
+        """
+        key = (round(x_dim, 4), round(y_dim, 4), round(depth, 4))
+        representation_map = self._map_cache.get(key)
+        if representation_map is None:
+            # A representation may not be both mapped and owned by a product, so the map gets its own
+            representation = self.model.createIfcShapeRepresentation(
+                self.body_context, "Body", "SweptSolid", [self._rectangle_solid(x_dim, y_dim, depth)])
+            representation_map = self.model.createIfcRepresentationMap(self._origin_placement, representation)
+            self._map_cache[key] = representation_map
+        return representation_map
+
+    def _z_offset(self, z: float):
+        """
+        Return a shared transformation operator translating a mapped item by `z`.
+        """
+        key = round(z, 4)
+        operator = self._offset_cache.get(key)
+        if operator is None:
+            origin = self.model.createIfcCartesianPoint((0.0, 0.0, float(z)))
+            operator = self.model.createIfcCartesianTransformationOperator3D(None, None, origin, None, None)
+            self._offset_cache[key] = operator
+        return operator
+
+    def _stacked_shape(self, x_dim: float, y_dim: float, depth: float, floor_count: int, floor_height: float):
+        """
+        Return a shape repeating the rectangle extrusion `floor_count` times, `floor_height` apart.
+        A single floor uses the plain extrusion; taller stacks instance one representation
+        map per floor via IfcMappedItem, so every floor shares the same geometry.
+        """
+        if floor_count <= 1:
+            return self._rectangle_shape(x_dim, y_dim, depth)
+
+        key = (round(x_dim, 4), round(y_dim, 4), round(depth, 4), floor_count, round(floor_height, 4))
+        shape = self._shape_cache.get(key)
+        if shape is None:
+            representation_map = self._representation_map(x_dim, y_dim, depth)
+            items = [
+                self.model.createIfcMappedItem(representation_map, self._z_offset(i * floor_height))
+                for i in range(floor_count)
+            ]
+            representation = self.model.createIfcShapeRepresentation(
+                self.body_context, "Body", "MappedRepresentation", items)
+            shape = self.model.createIfcProductDefinitionShape(None, None, [representation])
+            self._shape_cache[key] = shape
+        return shape
+
+    def _create_product(self, ifc_class: str, name: str, placement, shape):
+        """
+        Create a product entity directly, bypassing the ifcopenshell.api dispatch.
+        """
+        product = self.model.create_entity(
+            ifc_class,
+            GlobalId=self._new_guid(),
+            Name=name,
+            ObjectPlacement=placement,
+            Representation=shape,
+        )
+        self._pending_products.append(product)
+        return product
+
+    def _assign_pending_products(self):
+        """
+        Contain all pending elements in the storey and associate the default material,
+        reusing a single relationship of each kind for the whole model.
+        """
+        if not self._pending_products:
+            return
+        products = self._pending_products
+        self._pending_products = []
+
+        if self._containment_rel is None:
+            self._containment_rel = self.model.createIfcRelContainedInSpatialStructure(
+                self._new_guid(), None, None, None, products, self.storey)
+        else:
+            self._containment_rel.RelatedElements = list(self._containment_rel.RelatedElements) + products
+
+        if self._material_rel is None:
+            self._material_rel = self.model.createIfcRelAssociatesMaterial(
+                self._new_guid(), None, None, None, products, self.material)
+        else:
+            self._material_rel.RelatedObjects = list(self._material_rel.RelatedObjects) + products
+
+    def create_column(self, x: float, y: float, width: float, depth: float, height: float, elevation: float = 0.0,
+                      floor_count: int = 1, floor_height: float = 0.0):
         """
         Create a rectangular column at (x, y).
+        With floor_count > 1 a single column is stacked over that many floors, floor_height apart.
         """
-        # Create the column element
-        column = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcColumn", name="Column")
-        
-        # Define representation (Geometry)
-        # Create a 2D profile for extrusion
-        profile = self.model.createIfcRectangleProfileDef(ProfileType="AREA", XDim=width, YDim=depth)
-        
-        # Create extrusion
+        # Extruded 2D profile, shared with every column of the same size
         # Position of the profile is (0,0) relative to the column placement
-        # We need to place the column in the world
-        
-        # Create the 3D representation
-        representation = ifcopenshell.api.run("geometry.add_profile_representation", self.model, 
-                                              context=self.body_context, profile=profile, depth=height)
-        
-        # Assign representation to column
-        ifcopenshell.api.run("geometry.assign_representation", self.model, product=column, representation=representation)
-        
-        # Place the column
-        matrix = [
-            [1.0, 0.0, 0.0, x],
-            [0.0, 1.0, 0.0, y],
-            [0.0, 0.0, 1.0, 0.0],
-            [0.0, 0.0, 0.0, 1.0]
+        shape = self._stacked_shape(width, depth, height, floor_count, floor_height)
+
+        # Place the column in the world
+        placement = self._local_placement(x, y, elevation)
+
+        return self._create_product("IfcColumn", "Column", placement, shape)
+
+    def create_columns_batch(self, columns, height: float, elevation: float = 0.0,
+                             floor_count: int = 1, floor_height: float = 0.0):
+        """
+        Create one column per row of `columns`, an (M, 4) array of (x, y, width, depth).
+        Equivalent to calling create_column per row, with the method lookups hoisted out of the loop.
+        """
+        stacked_shape = self._stacked_shape
+        local_placement = self._local_placement
+        create_product = self._create_product
+        return [
+            create_product("IfcColumn", "Column", local_placement(x, y, elevation),
+                           stacked_shape(width, depth, height, floor_count, floor_height))
+            for x, y, width, depth in np.asarray(columns, dtype=np.float64).tolist()
         ]
-        
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=column, matrix=matrix)
-        
-        # Assign material
-        ifcopenshell.api.run("material.assign_material", self.model, products=[column], material=self.material)
-        
-        # Assign to storey
-        ifcopenshell.api.run("spatial.assign_container", self.model, relating_structure=self.storey, products=[column])
-        
-        return column
 
-    def create_beam(self, x1: float, y1: float, x2: float, y2: float, width: float, depth: float, elevation: float):
+    def create_beam(self, x1: float, y1: float, x2: float, y2: float, width: float, depth: float, elevation: float,
+                    floor_count: int = 1, floor_height: float = 0.0):
         """
         Create a beam connecting (x1, y1) and (x2, y2) at a specific elevation (z).
+        With floor_count > 1 the beam is repeated on that many floors, floor_height apart.
         """
-        beam = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcBeam", name="Beam")
-        
         # Calculate length and rotation
-        import math
         dx = x2 - x1
         dy = y2 - y1
-        length = math.sqrt(dx*dx + dy*dy)
+        length = math.hypot(dx, dy)
         rotation = math.atan2(dy, dx)
-        
+        cx = (x1 + x2) / 2
+        cy = (y1 + y2) / 2
+        return self._create_beam_at(cx, cy, length, math.cos(rotation), math.sin(rotation), width, depth, elevation,
+                                    floor_count=floor_count, floor_height=floor_height)
+
+    def _create_beam_at(self, cx: float, cy: float, length: float, cos_r: float, sin_r: float, width: float, depth: float,
+                        elevation: float, floor_count: int = 1, floor_height: float = 0.0):
+        """
+        Create a beam from precomputed geometry: midpoint (cx, cy), length and the cos/sin of its rotation.
+        """
         # Profile (Beam cross section: depth is height of beam, width is width)
-        profile = self.model.createIfcRectangleProfileDef(ProfileType="AREA", XDim=length, YDim=width)
-        
         # Representation (Extrude along Z by the 'depth' of the beam)
         # Note: In IFC, we can extrude a profile along an axis.
         # To make a beam, we can extrude the rectangular cross-section along the length.
         # For simplicity, we'll extrude the (length x width) profile by 'depth' (height of beam).
-        representation = ifcopenshell.api.run("geometry.add_profile_representation", self.model, 
-                                              context=self.body_context, profile=profile, depth=depth)
-        
-        ifcopenshell.api.run("geometry.assign_representation", self.model, product=beam, representation=representation)
+        shape = self._stacked_shape(length, width, depth, floor_count, floor_height)
         
         # Placement
-        # We need to place the center of the beam at the midpoint and rotate it.
-        cx = (x1 + x2) / 2
-        cy = (y1 + y2) / 2
-        
-        # Rotation Matrix around Z
-        cos_r = math.cos(rotation)
-        sin_r = math.sin(rotation)
-        
-        # Matrix:
-        # [ cos -sin  0  cx ]
-        # [ sin  cos  0  cy ]
-        # [  0    0   1  el ]
-        # [  0    0   0   1 ]
-        matrix = [
-            [cos_r, -sin_r, 0.0, cx],
-            [sin_r,  cos_r, 0.0, cy],
-            [0.0,    0.0,   1.0, elevation],
-            [0.0,    0.0,   0.0, 1.0]
-        ]
-        
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=beam, matrix=matrix)
+        # We need to place the center of the beam at the midpoint and rotate it around Z.
+        placement = self._local_placement(cx, cy, elevation, direction=(cos_r, sin_r))
         
-        # Assign material
-        ifcopenshell.api.run("material.assign_material", self.model, products=[beam], material=self.material)
-        
-        ifcopenshell.api.run("spatial.assign_container", self.model, relating_structure=self.storey, products=[beam])
-        
-        return beam
+        return self._create_product("IfcBeam", "Beam", placement, shape)
 
     def create_slab(self, x: float, y: float, width: float, depth: float, thickness: float, elevation: float):
         """
         Create a rectangular slab.
         """
-        slab = ifcopenshell.api.run("root.create_entity", self.model, ifc_class="IfcSlab", name="Slab")
-        
-        profile = self.model.createIfcRectangleProfileDef(ProfileType="AREA", XDim=width, YDim=depth)
-        representation = ifcopenshell.api.run("geometry.add_profile_representation", self.model, 
-                                              context=self.body_context, profile=profile, depth=thickness)
-        
-        ifcopenshell.api.run("geometry.assign_representation", self.model, product=slab, representation=representation)
-        
-        matrix = [
-            [1.0, 0.0, 0.0, x],
-            [0.0, 1.0, 0.0, y],
-            [0.0, 0.0, 1.0, elevation],
-            [0.0, 0.0, 0.0, 1.0]
-        ]
-        
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=slab, matrix=matrix)
+        shape = self._rectangle_shape(width, depth, thickness)
         
-        # Assign material
-        ifcopenshell.api.run("material.assign_material", self.model, products=[slab], material=self.material)
+        # Placement: a single translated point, no 4x4 matrix round-trip
+        placement = self._local_placement(x, y, elevation)
         
-        ifcopenshell.api.run("spatial.assign_container", self.model, relating_structure=self.storey, products=[slab])
-        
-        return slab
+        return self._create_product("IfcSlab", "Slab", placement, shape)
 
-    def create_generic_element(self, x: float, y: float, width: float, depth: float, height: float, elevation: float, ifc_class="IfcBuildingElementProxy", name="Element"):
+    def create_generic_element(self, x: float, y: float, width: float, depth: float, height: float, elevation: float, ifc_class="IfcBuildingElementProxy", name="Element",
+                               floor_count: int = 1, floor_height: float = 0.0):
         """
         Create a generic rectangular element for objects like Doors/Windows/Slabs
         to ensure they appear in the 3D viewer.
+        With floor_count > 1 the element is repeated on that many floors, floor_height apart.
         """
-        element = ifcopenshell.api.run("root.create_entity", self.model, ifc_class=ifc_class, name=name)
-        
-        # Profile
-        profile = self.model.createIfcRectangleProfileDef(ProfileType="AREA", XDim=width, YDim=depth)
-        
-        # Representation (Extrusion)
-        representation = ifcopenshell.api.run("geometry.add_profile_representation", self.model, 
-                                              context=self.body_context, profile=profile, depth=height)
-        
-        ifcopenshell.api.run("geometry.assign_representation", self.model, product=element, representation=representation)
-        
-        # Placement
-        # Fix: Manually construct the matrix instead of using the API if it's missing in this version
-        # 4x4 Identity Matrix with translation
-        # [ 1, 0, 0, x ]
-        # [ 0, 1, 0, y ]
-        # [ 0, 0, 1, elevation ]
-        # [ 0, 0, 0, 1 ]
-        
-        matrix = [
-            [1.0, 0.0, 0.0, x],
-            [0.0, 1.0, 0.0, y],
-            [0.0, 0.0, 1.0, elevation],
-            [0.0, 0.0, 0.0, 1.0]
-        ]
-        
-        ifcopenshell.api.run("geometry.edit_object_placement", self.model, product=element, matrix=matrix)
+        # Representation (Extrusion of a shared profile)
+        shape = self._stacked_shape(width, depth, height, floor_count, floor_height)
         
-        # Assign material
-        ifcopenshell.api.run("material.assign_material", self.model, products=[element], material=self.material)
+        # Placement: a single translated point, no 4x4 matrix round-trip
+        placement = self._local_placement(x, y, elevation)
         
-        # Assign to storey
-        ifcopenshell.api.run("spatial.assign_container", self.model, relating_structure=self.storey, products=[element])
-        return element
+        return self._create_product(ifc_class, name, placement, shape)
 
     def generate_simple_extrusion(self, det_results: dict, scale: float, height: float, floor_count: int):
         """
@@ -223,60 +366,43 @@ class IfcGenerator:
         """
         detections = det_results.get('detections', [])
         if not detections:
-            print("No detections found for IFC generation.")
+            logger.warning("No detections found for IFC generation.")
+            return
+        if floor_count < 1:
+            logger.warning("Floor count must be at least 1 for IFC generation.")
             return
 
-        # 1. First pass: Calculate average center to offset the model to (0,0,0)
+        # 1. Convert all bboxes [x1, y1, x2, y2] from pixels to metres in one shot
+        bboxes = np.array([det['bbox'] for det in detections], dtype=np.float64) * scale
+        sizes = bboxes[:, 2:4] - bboxes[:, 0:2] # (width, depth)
+        centers = bboxes[:, 0:2] + sizes * 0.5
+
+        # Offset by the average center so the model sits at (0,0,0).
         # This ensures the model is visible in the center of the 3D viewer.
-        total_cx = 0
-        total_cy = 0
-        for det in detections:
-            bbox = det['bbox']
-            x_mid = (bbox[0] + bbox[2]) / 2 * scale
-            y_mid = (bbox[1] + bbox[3]) / 2 * scale
-            total_cx += x_mid
-            total_cy += y_mid
-        
-        offset_x = total_cx / len(detections)
-        offset_y = total_cy / len(detections)
-
-        # 2. Second pass: Create elements with offset
-        for det in detections:
-            cls = det['class'].lower() 
-            bbox = det['bbox']
-            
-            x1_m = bbox[0] * scale
-            y1_m = bbox[1] * scale
-            x2_m = bbox[2] * scale
-            y2_m = bbox[3] * scale
-            
-            width = x2_m - x1_m
-            depth = y2_m - y1_m
-            
-            # Centered at (0,0) relative to the whole building
-            cx = (x1_m + width / 2) - offset_x
-            cy = -((y1_m + depth / 2) - offset_y) # Flip Y and apply offset
-            
-            for i in range(floor_count):
-                elevation = i * height
-                
-                # Logic for different classes
-                if cls in ['column', 'person']: 
-                    self.create_column(cx, cy, width, depth, height, elevation=elevation)
-                elif cls in ['door', 'double-door', 'sliding door', 'garage door']:
-                    self.create_generic_element(cx, cy, width, depth, height * 0.8, elevation, ifc_class="IfcDoor", name=cls.title())
-                elif cls in ['window', 'ventilator']:
-                    sill_height = height * 0.3
-                    win_height = height * 0.4
-                    self.create_generic_element(cx, cy, width, depth, win_height, elevation + sill_height, ifc_class="IfcWindow", name=cls.title())
-                elif cls in ['staircase', 'stairs']:
-                    self.create_generic_element(cx, cy, width, depth, height * 0.5, elevation, ifc_class="IfcStair", name="Staircase")
-                elif cls == 'slab':
-                     self.create_slab(cx, cy, width, depth, 0.2, elevation)
-                else:
-                    self.create_generic_element(cx, cy, width, depth, height * 0.5, elevation, ifc_class="IfcBuildingElementProxy", name=cls.title())
-        
-        print(f"Generated simple extrusion for {len(detections)} objects across {floor_count} floors.")
+        centers -= centers.mean(axis=0)
+        centers[:, 1] *= -1.0 # Flip Y
+
+        # One GlobalId per element plus the containment and material relationships
+        self._reserve_guids(len(detections) + 2)
+
+        # 2. Create elements: one element per detection, stacked over all floors
+        classes = [det['class'].lower() for det in detections]
+        handlers = [CLASS_DISPATCH.get(cls, _make_proxy) for cls in classes]
+
+        # Columns are the bulk of a structural plan, build them in one batch
+        is_column = np.fromiter((handler is _make_column for handler in handlers), dtype=bool, count=len(handlers))
+        if is_column.any():
+            self.create_columns_batch(np.hstack([centers, sizes])[is_column], height,
+                                      floor_count=floor_count, floor_height=height)
+
+        for cls, handler, (cx, cy), (width, depth) in zip(classes, handlers, centers.tolist(), sizes.tolist()):
+            if handler is _make_column:
+                continue
+            # Logic for different classes, unknown classes become generic proxies
+            handler(self, cls, cx, cy, width, depth, height, floor_count)
+        
+        self._assign_pending_products()
+        logger.info("Generated simple extrusion for %s objects across %s floors.", len(detections), floor_count)
 
     def generate_advanced_structure(self, graph_data: dict, scale: float, height: float, floor_count: int):
         """
@@ -285,47 +411,134 @@ class IfcGenerator:
         """
         nodes = graph_data.get('nodes', [])
         if not nodes:
-            print("No nodes found for advanced structure generation.")
+            logger.warning("No nodes found for advanced structure generation.")
+            return
+        if floor_count < 1:
+            logger.warning("Floor count must be at least 1 for advanced structure generation.")
             return
 
-        # 1. Calculate offset to center the model
-        total_cx = sum(node['x'] for node in nodes) * scale
-        total_cy = sum(node['y'] for node in nodes) * scale
-        offset_x = total_cx / len(nodes)
-        offset_y = total_cy / len(nodes)
-
-        # 2. Create Nodes (Columns)
-        node_map = {}
-        for i, node in enumerate(nodes):
-            cx = (node['x'] * scale) - offset_x
-            cy = -((node['y'] * scale) - offset_y) # Flip Y
-            width = node['width'] * scale
-            depth = node['depth'] * scale
-            
-            for f in range(floor_count):
-                elevation = f * height
-                self.create_column(cx, cy, width, depth, height, elevation=elevation)
-                if f == 0:
-                    node_map[i] = (cx, cy)
+        # 1. Scale all nodes at once and offset them to center the model
+        node_arr = np.array([(node['x'], node['y'], node['width'], node['depth']) for node in nodes],
+                            dtype=np.float64) * scale
+        centers = node_arr[:, 0:2] - node_arr[:, 0:2].mean(axis=0)
+        centers[:, 1] *= -1.0 # Flip Y
+        sizes = node_arr[:, 2:4]
 
-        # 3. Create Edges (Beams)
+        # One GlobalId per column and beam plus the containment and material relationships
         edges = graph_data.get('edges', [])
-        for edge in edges:
-            source_idx = edge['source']
-            target_idx = edge['target']
-            
-            if source_idx in node_map and target_idx in node_map:
-                p1 = node_map[source_idx]
-                p2 = node_map[target_idx]
-                
-                beam_width = 0.3
-                beam_depth = 0.5 
-                
-                for f in range(floor_count):
-                    elevation = (f + 1) * height - beam_depth 
-                    self.create_beam(p1[0], p1[1], p2[0], p2[1], beam_width, beam_depth, elevation=elevation)
+        self._reserve_guids(len(nodes) + len(edges) + 2)
+
+        # 2. Create Nodes (Columns), one column stacked over all floors per node
+        self.create_columns_batch(np.hstack([centers, sizes]), height, floor_count=floor_count, floor_height=height)
+
+        # 3. Create Edges (Beams)
+        # Node positions are indexed directly by node id, edges pointing outside the graph are dropped
+        node_xy = centers
+        sources = np.fromiter((edge['source'] for edge in edges), dtype=np.int64, count=len(edges))
+        targets = np.fromiter((edge['target'] for edge in edges), dtype=np.int64, count=len(edges))
+        valid = (sources >= 0) & (sources < len(nodes)) & (targets >= 0) & (targets < len(nodes))
+        p1 = node_xy[sources[valid]]
+        p2 = node_xy[targets[valid]]
+        if len(p1):
+            # Compute every beam's midpoint, length and rotation in one pass
+            deltas = p2 - p1
+            mids = (p1 + p2) * 0.5
+            lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+            rotations = np.arctan2(deltas[:, 1], deltas[:, 0])
+            cos_r = np.cos(rotations)
+            sin_r = np.sin(rotations)
+
+            beam_width = 0.3
+            beam_depth = 0.5 
+            # Beams sit under each floor's ceiling, repeated on every floor
+            elevation = height - beam_depth 
+
+            for (cx, cy), length, c, s in zip(mids.tolist(), lengths.tolist(), cos_r.tolist(), sin_r.tolist()):
+                self._create_beam_at(cx, cy, length, c, s, beam_width, beam_depth, elevation,
+                                     floor_count=floor_count, floor_height=height)
         
-        print(f"Generated advanced structure with {len(nodes)} nodes and {len(edges)} edges.")
+        self._assign_pending_products()
+        logger.info("Generated advanced structure with %s nodes and %s edges.", len(nodes), len(edges))
 
     def save(self, path: str):
+        self._assign_pending_products()
+        # write() streams STEP records from the C++ model straight into the file,
+        # so there is no full in-memory copy of the serialized model on the Python side
         self.model.write(path)
+        # Optional HDF5 geometry cache next to the STEP file, for viewers that can skip STEP parsing
+        if os.environ.get("IFC_HDF5_CACHE", "0") == "1":
+            self.export_hdf5(os.path.splitext(path)[0] + ".h5")
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the model to STEP in memory, for callers that serve it without a file round-trip.
+        """
+        self._assign_pending_products()
+        return self.model.to_string().encode()
+
+    def export_hdf5(self, path: str) -> bool:
+        """
+        Write the tessellated geometry to an HDF5 cache.
+        Returns False when this ifcopenshell build has no HDF5 serializer.
+        """
+        import ifcopenshell.geom
+
+        serializer_factory = getattr(ifcopenshell.geom.serializers, "hdf5", None)
+        if serializer_factory is None:
+            logger.warning("HDF5 serializer not available in this ifcopenshell build, skipping HDF5 export.")
+            return False
+
+        settings = ifcopenshell.geom.settings()
+        serializer = serializer_factory(path, settings, ifcopenshell.geom.serializer_settings())
+        serializer.setFile(self.model)
+        serializer.writeHeader()
+        iterator = ifcopenshell.geom.iterator(settings, self.model, os.cpu_count() or 1)
+        if iterator.initialize():
+            while True:
+                serializer.write(iterator.get())
+                if not iterator.next():
+                    break
+        serializer.finalize()
+        return True
+
+
+# Element builders for generate_simple_extrusion, keyed by lower-case detection class.
+# Each one creates a single element stacked over `floor_count` floors of `height`.
+def _make_column(gen, cls, cx, cy, width, depth, height, floor_count):
+    gen.create_column(cx, cy, width, depth, height, floor_count=floor_count, floor_height=height)
+
+def _make_door(gen, cls, cx, cy, width, depth, height, floor_count):
+    gen.create_generic_element(cx, cy, width, depth, height * 0.8, 0.0, ifc_class="IfcDoor", name=cls.title(),
+                               floor_count=floor_count, floor_height=height)
+
+def _make_window(gen, cls, cx, cy, width, depth, height, floor_count):
+    sill_height = height * 0.3
+    win_height = height * 0.4
+    gen.create_generic_element(cx, cy, width, depth, win_height, sill_height, ifc_class="IfcWindow", name=cls.title(),
+                               floor_count=floor_count, floor_height=height)
+
+def _make_stair(gen, cls, cx, cy, width, depth, height, floor_count):
+    gen.create_generic_element(cx, cy, width, depth, height * 0.5, 0.0, ifc_class="IfcStair", name="Staircase",
+                               floor_count=floor_count, floor_height=height)
+
+def _make_slab(gen, cls, cx, cy, width, depth, height, floor_count):
+    gen.create_generic_element(cx, cy, width, depth, 0.2, 0.0, ifc_class="IfcSlab", name="Slab",
+                               floor_count=floor_count, floor_height=height)
+
+def _make_proxy(gen, cls, cx, cy, width, depth, height, floor_count):
+    gen.create_generic_element(cx, cy, width, depth, height * 0.5, 0.0, ifc_class="IfcBuildingElementProxy", name=cls.title(),
+                               floor_count=floor_count, floor_height=height)
+
+CLASS_DISPATCH = {
+    'column': _make_column,
+    'person': _make_column,
+    'door': _make_door,
+    'double-door': _make_door,
+    'sliding door': _make_door,
+    'garage door': _make_door,
+    'window': _make_window,
+    'ventilator': _make_window,
+    'staircase': _make_stair,
+    'stairs': _make_stair,
+    'slab': _make_slab,
+}
@@ -1,9 +1,19 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.middleware.cors import CORSMiddleware
+import gzip
+import hashlib
+import logging
+import logging.handlers
+import queue
 import shutil
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import mimetypes
+import orjson
 import os
+import re
 import uuid
-from typing import Optional
 from fastapi import Response
 
 from processing_unit.vision_model import VisionReasoner
@@ -11,7 +21,30 @@ from processing_unit.system_manager import SystemManager
 from pydantic import BaseModel
 from generating_unit.ifc_generator import IfcGenerator
 
-app = FastAPI(title="MCC AI Construction System")
+# Log calls only enqueue the record; one listener thread formats and writes them to stderr.
+# Same "[time] [LEVEL] message" layout as the SystemManager log buffer.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", datefmt="%H:%M:%S"))
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# The queue handler only merges the message arguments, the layout is applied by the listener
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _log_listener.start()
+    # Initialize System Manager (Singleton) when the server starts rather than at import;
+    # initialization also warms the detector up so the first /process call runs on a hot model.
+    app.state.system_manager = SystemManager.instance()
+    app.state.vision_reasoner = VisionReasoner() # It internally uses SystemManager
+    yield
+    # Flushes whatever is still queued
+    _log_listener.stop()
+
+# orjson serializes the JSON responses directly, skipping the stdlib encoder
+app = FastAPI(title="MCC AI Construction System", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -22,31 +55,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize System Manager (Singleton)
-system_manager = SystemManager()
-vision_reasoner = VisionReasoner() # It internally uses SystemManager
-
 class ChatRequest(BaseModel):
     message: str
 
+# Single "bytes=start-end" range, either end may be omitted ("bytes=-500" is the last 500 bytes)
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_RANGE_CHUNK_SIZE = 1 << 20
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    True when an Accept-Encoding header allows gzip, by name or through "*", with q > 0.
+    """
+    qvalues = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    if "gzip" in qvalues:
+        return qvalues["gzip"] > 0
+    return qvalues.get("*", 0) > 0
+
+def _gzip_copy(path: str, st: os.stat_result) -> os.stat_result:
+    """
+    Stat of the gzip copy of `path`, compressing it on first use or when the file is newer.
+    Written to a temporary name and renamed, so concurrent downloads never see a partial copy.
+    """
+    gz_path = path + ".gz"
+    try:
+        gz_st = os.stat(gz_path)
+        if gz_st.st_mtime_ns >= st.st_mtime_ns:
+            return gz_st
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{gz_path}.{uuid.uuid4().hex}.tmp"
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, _RANGE_CHUNK_SIZE)
+    os.replace(tmp_path, gz_path)
+    return os.stat(gz_path)
+
+def _file_validators(st: os.stat_result) -> dict:
+    """
+    ETag and Last-Modified for a file, computed the way FileResponse does for full downloads,
+    so partial and full responses of the same file validate against each other.
+    """
+    etag = hashlib.md5(f"{st.st_mtime}-{st.st_size}".encode(), usedforsecurity=False).hexdigest()
+    return {"ETag": f'"{etag}"', "Last-Modified": formatdate(st.st_mtime, usegmt=True)}
+
+def _parse_range(range_header: str, size: int):
+    """
+    Resolve a single "bytes=" range against the file size. Returns (start, end) inclusive,
+    "unsatisfiable" when the range lies past the end of the file, or None when the header
+    is missing, malformed or a multi-range request, in which case it is ignored.
+    """
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        if match.group(2) and int(match.group(2)) < start:
+            # Syntactically invalid (e.g. bytes=5-2), ignored rather than refused
+            return None
+        if start >= size:
+            return "unsatisfiable"
+        return start, min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    suffix = int(match.group(2))
+    if suffix == 0 or size == 0:
+        return "unsatisfiable"
+    return max(size - suffix, 0), size - 1
+
+def _iter_file_range(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+# Constant payloads and headers, encoded once at import
+_ROOT_BODY = orjson.dumps({"message": "Floor Plan AI System Backend is Running (Managed)"})
+_IFC_HEAD_HEADERS = {
+    "Content-Type": "application/p21",
+    "Accept-Ranges": "bytes",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Expose-Headers": "Content-Length, Content-Type, Accept-Ranges",
+}
+
 @app.get("/")
 def read_root():
-    return {"message": "Floor Plan AI System Backend is Running (Managed)"}
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 @app.get("/health")
 def health_check():
     return {"status": "ok", "timestamp": str(uuid.uuid4())}
 
 @app.post("/chat")
-async def chat_agent(request: ChatRequest):
+async def chat_agent(request: ChatRequest, http_request: Request):
     """
     Endpoint for the embedded chat agent.
     """
-    response = await vision_reasoner.chat_with_user(request.message)
+    response = await http_request.app.state.vision_reasoner.chat_with_user(request.message)
     return response
 
+@app.post("/chat/stream")
+async def chat_agent_stream(request: ChatRequest, http_request: Request):
+    """
+    Streaming chat endpoint (Server-Sent Events). Each event is a JSON object: {"delta": ...}
+    while the agent is typing, then a final one with "done": true, "reply" and "updated_params".
+    """
+    async def events():
+        async for event in http_request.app.state.vision_reasoner.chat_with_user_stream(request.message):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/process")
 async def process_drawing(
+    request: Request,
     file: UploadFile = File(...),
     scale: float = Form(None), # Optional, defaults to SystemManager config
     height: float = Form(None),  
@@ -56,7 +192,7 @@ async def process_drawing(
     """
     Process an uploaded PDF/Image and generate a 3D IFC model via SystemManager.
     """
-    result = await system_manager.process_workflow(
+    result = await request.app.state.system_manager.process_workflow(
         file=file,
         scale=scale,
         height=height,
@@ -67,40 +203,93 @@ async def process_drawing(
     return result
 
 @app.get("/download/{filename}")
-def download_file(filename: str):
+def download_file(filename: str, request: Request, format: str = "ifc"):
     from fastapi.responses import FileResponse
-    path = os.path.join(system_manager.output_dir, filename)
-    if os.path.exists(path):
-        return FileResponse(path)
-    return {"error": "File not found"}
+    path = os.path.join(request.app.state.system_manager.output_dir, filename)
+    if format == "hdf5":
+        # HDF5 geometry cache, only written when IFC_HDF5_CACHE=1 and the serializer is available
+        path = os.path.splitext(path)[0] + ".h5"
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {"error": "File not found"}
+    size = st.st_size
 
-@app.head("/download/{filename}")
-def download_head(filename: str):
-    path = os.path.join(system_manager.output_dir, filename)
-    if os.path.exists(path):
-        size = os.path.getsize(path)
+    # Byte ranges let viewers resume or parallelize large downloads; multi-range
+    # requests are answered with the whole file
+    byte_range = _parse_range(request.headers.get("range", ""), size)
+    validators = _file_validators(st)
+    if_range = request.headers.get("if-range")
+    if byte_range is not None and if_range is not None and if_range not in validators.values():
+        # The client's copy is stale, so it gets the whole current file
+        byte_range = None
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    if byte_range is not None:
+        start, end = byte_range
         headers = {
-            "Content-Type": "application/p21",
-            "Content-Length": str(size),
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Expose-Headers": "Content-Length, Content-Type",
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+            "Accept-Ranges": "bytes",
+            "Vary": "Accept-Encoding",
+            **validators,
         }
-        return Response(status_code=200, headers=headers)
-    return Response(status_code=404)
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return StreamingResponse(_iter_file_range(path, start, end - start + 1), status_code=206,
+                                 media_type=media_type, headers=headers)
+
+    # Full IFC downloads go out gzip-compressed to clients that accept it; STEP text shrinks
+    # 5-10x. The compressed copy is made on the first such request and reused afterwards.
+    if format == "ifc" and _accepts_gzip(request.headers.get("accept-encoding", "")):
+        gz_st = _gzip_copy(path, st)
+        headers = {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        media_type = mimetypes.guess_type(path)[0] or "text/plain"
+        return FileResponse(path + ".gz", media_type=media_type, headers=headers, stat_result=gz_st)
+    return FileResponse(path, headers={"Accept-Ranges": "bytes", "Vary": "Accept-Encoding"}, stat_result=st)
+
+@app.head("/download/{filename}")
+def download_head(filename: str, request: Request):
+    path = os.path.join(request.app.state.system_manager.output_dir, filename)
+    # One stat answers both "does it exist" and "how big is it"
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return Response(status_code=404)
+    return Response(status_code=200, headers={**_IFC_HEAD_HEADERS, "Content-Length": str(size)})
+
+# Serialized sample IFC and the (mtime_ns, size) of output/sample.ifc it matches.
+# Built on the first request and served from memory while the file on disk is unchanged.
+_sample_ifc_cache = None
 
 @app.get("/debug/sample-ifc")
-def debug_sample_ifc():
-    from fastapi.responses import FileResponse
-    path = os.path.join(system_manager.output_dir, "sample.ifc")
+def debug_sample_ifc(request: Request):
+    global _sample_ifc_cache
+    path = os.path.join(request.app.state.system_manager.output_dir, "sample.ifc")
+    # One stat per request keeps this endpoint and /download/sample.ifc in agreement
     try:
-        gen = IfcGenerator(project_name="DebugSample")
-        gen.create_column(0.0, 0.0, 0.5, 0.5, 3.0, 0.0)
-        gen.save(path)
-    except Exception as e:
-        return {"error": str(e)}
-    if os.path.exists(path):
-        return FileResponse(path)
-    return {"error": "Sample IFC not generated"}
+        st = os.stat(path)
+        file_key = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        file_key = None
+    if _sample_ifc_cache is None or _sample_ifc_cache[1] != file_key:
+        try:
+            if _sample_ifc_cache is not None and file_key is not None:
+                # Replaced on disk, serve what /download/sample.ifc serves
+                with open(path, "rb") as f:
+                    data = f.read()
+            else:
+                # First request or deleted file, rebuild it with the current generator
+                gen = IfcGenerator(project_name="DebugSample")
+                gen.create_column(0.0, 0.0, 0.5, 0.5, 3.0, 0.0)
+                data = gen.to_bytes()
+                # Still written out, so /download/sample.ifc keeps working
+                with open(path, "wb") as f:
+                    f.write(data)
+            st = os.stat(path)
+        except Exception as e:
+            return {"error": str(e)}
+        _sample_ifc_cache = (data, (st.st_mtime_ns, st.st_size))
+    return Response(content=_sample_ifc_cache[0], media_type="application/p21")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple
+
+class AsyncBatchQueue:
+    """
+    Collects single requests from concurrent coroutines and runs them as one batch.
+
+    `batch_fn` is a blocking callable that takes a list of items and returns one result
+    per item, in order. It runs in a worker thread so the event loop stays responsive,
+    on `executor` if given, otherwise on the loop's default executor.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait_time: float = 0.1,
+                 executor: Optional[Executor] = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def add_request(self, item: Any) -> Any:
+        """
+        Queue one item and wait for its result.
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def add_requests(self, items: List[Any]) -> List[Any]:
+        """
+        Queue several items (e.g. the pages of a PDF) and wait for all of their results.
+        """
+        return list(await asyncio.gather(*(self.add_request(item) for item in items)))
+
+    def _ensure_started(self):
+        # The consumer is started lazily on the running loop, and restarted if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self.process_loop())
+
+    async def process_loop(self):
+        """
+        Gather up to `max_batch_size` items, or whatever arrived within `max_wait_time`
+        of the first one, and resolve each caller's future from a single batch call.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[Any, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_time
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    self._resolve(batch, [], e)
+                    continue
+                # One bad item (e.g. an unreadable upload) must not fail the rest of the batch,
+                # so rerun every item on its own and give each caller its own outcome
+                for entry in batch:
+                    try:
+                        single = await loop.run_in_executor(self.executor, self.batch_fn, [entry[0]])
+                    except Exception as item_error:
+                        self._resolve([entry], [], item_error)
+                    else:
+                        self._resolve([entry], single)
+                continue
+
+            self._resolve(batch, results)
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[Any, asyncio.Future]], results: List[Any], error: Optional[Exception] = None):
+        """
+        Set each future from its result; futures without one (batch_fn returned too few
+        results, or failed) get `error`, so no caller is left waiting.
+        """
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        if len(results) < len(batch):
+            if error is None:
+                error = RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            for _, future in batch[len(results):]:
+                if not future.done():
+                    future.set_exception(error)
@@ -2,7 +2,12 @@ from ultralytics import YOLO
 import cv2
 import os
 import numpy as np
-from typing import List, Dict, Any
+import torch
+from functools import lru_cache
+import logging
+from typing import List, Dict, Any, Optional, Union
+
+logger = logging.getLogger("mcc.detection")
 
 class ObjectDetector:
     def __init__(self, model_path: str = "yolo26n.pt"):
@@ -16,53 +21,108 @@ class ObjectDetector:
         self.model_path = model_path
         # Try to load custom trained model first
         if os.path.exists(self.model_path):
-            print(f"[INFO] Loading Custom YOLO Model from: {os.path.abspath(self.model_path)}")
+            logger.info("Loading Custom YOLO Model from: %s", os.path.abspath(self.model_path))
             self.model = YOLO(self.model_path)
         else:
-            print(f"[WARN] Custom model not found at {self.model_path}. Falling back to 'yolo11n.pt' (COCO pretrained).")
-            print("[WARN] Structural elements like columns/beams will NOT be detected correctly.")
+            logger.warning("Custom model not found at %s. Falling back to 'yolo11n.pt' (COCO pretrained).", self.model_path)
+            logger.warning("Structural elements like columns/beams will NOT be detected correctly.")
             self.model = YOLO("yolo11n.pt") 
             
-        print(f"[INFO] YOLO Model Classes: {self.model.names}")
+        logger.info("YOLO Model Classes: %s", self.model.names)
         self.class_names = self.model.names
 
-    def predict(self, image_path: str, conf_threshold: float = 0.25) -> Dict[str, Any]:
+    def warmup(self, imgsz: int = 640):
+        """
+        Run one dummy inference so the first real request does not pay for
+        model fusing, device setup and kernel selection.
+        """
+        if torch.cuda.is_available():
+            # Let cuDNN pick the fastest conv algorithms, the warmup pass runs the autotune
+            torch.backends.cudnn.benchmark = True
+        self.model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+
+    def predict(self, image_path: Union[str, np.ndarray], conf_threshold: float = 0.25,
+                save_viz_path: Optional[str] = None) -> Dict[str, Any]:
         """
         Run inference on an image.
         
         Args:
-            image_path (str): Path to the input image.
+            image_path (str | np.ndarray): Path to the input image, or an already loaded BGR image.
             conf_threshold (float): Confidence threshold for detections.
+            save_viz_path (str, optional): If set, the annotated image is saved here from the same result.
             
         Returns:
             Dict containing detections and metadata.
         """
-        results = self.model.predict(image_path, conf=conf_threshold)
-        result = results[0] # We process one image at a time
+        save_viz_paths = [save_viz_path] if save_viz_path else None
+        return self.predict_batch([image_path], conf_threshold=conf_threshold, save_viz_paths=save_viz_paths)[0]
+
+    def predict_batch(self, images: List[Union[str, np.ndarray]], conf_threshold: float = 0.25,
+                      save_viz_paths: Optional[List[Optional[str]]] = None) -> List[Dict[str, Any]]:
+        """
+        Run inference on several images in a single forward pass.
         
-        detections = []
-        for box in result.boxes:
-            cls_id = int(box.cls[0])
-            class_name = self.class_names[cls_id]
-            confidence = float(box.conf[0])
-            xyxy = box.xyxy[0].tolist() # [x1, y1, x2, y2]
+        Args:
+            images (list): Image paths and/or already loaded BGR images.
+            conf_threshold (float): Confidence threshold for detections.
+            save_viz_paths (list, optional): Per-image output paths for annotated images, None entries are skipped.
             
-            detections.append({
-                "class": class_name,
-                "confidence": confidence,
-                "bbox": xyxy
+        Returns:
+            One dict of detections and metadata per input image, in input order.
+        """
+        if not images:
+            return []
+
+        arrays = []
+        for image in images:
+            if isinstance(image, str):
+                array = cv2.imread(image)
+                if array is None:
+                    raise FileNotFoundError(f"Image not found or unreadable: {image}")
+                arrays.append(array)
+            else:
+                arrays.append(image)
+
+        results = self.model.predict(arrays, conf=conf_threshold, stream=False)
+
+        outputs = []
+        for i, (image, result) in enumerate(zip(images, results)):
+            if save_viz_paths and save_viz_paths[i]:
+                result.save(filename=save_viz_paths[i])  # reuse this inference for the visualization
+
+            # Move all boxes to host memory at once instead of syncing per box
+            boxes = result.boxes
+            cls_ids = boxes.cls.cpu().numpy().astype(np.int32).tolist()
+            confidences = boxes.conf.cpu().numpy().tolist()
+            xyxys = boxes.xyxy.cpu().numpy().tolist() # [x1, y1, x2, y2] per box
+
+            detections = [
+                {
+                    "class": self.class_names[cls_id],
+                    "confidence": confidence,
+                    "bbox": xyxy
+                }
+                for cls_id, confidence, xyxy in zip(cls_ids, confidences, xyxys)
+            ]
+                
+            outputs.append({
+                "file": image if isinstance(image, str) else None,
+                "count": len(detections),
+                "detections": detections
             })
-            
-        return {
-            "file": image_path,
-            "count": len(detections),
-            "detections": detections
-        }
+        return outputs
 
     def visualize(self, image_path: str, output_path: str):
         """
         Visualize detections and save the image.
+        Returns the detections so callers do not need a second predict.
         """
-        results = self.model.predict(image_path)
-        result = results[0]
-        result.save(filename=output_path)  # save to disk
+        return self.predict(image_path, save_viz_path=output_path)
+
+
+@lru_cache(maxsize=None)
+def get_detector(model_path: str) -> ObjectDetector:
+    """
+    Return the shared ObjectDetector for a weights file, loading it on first use.
+    """
+    return ObjectDetector(model_path=model_path)
@@ -1,17 +1,58 @@
+import asyncio
+import hashlib
+import logging
 import uuid
 import os
 import shutil
 import subprocess
+import sys
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
 from enum import Enum
 from typing import Dict, Any, List, Optional
 import time
 import fitz
+import numpy as np
 
 # Import actual processing classes
-from processing_unit.object_detection import ObjectDetector
+from processing_unit.object_detection import get_detector
 from processing_unit.ocr_extraction import OCRExtractor
+from processing_unit.batch_queue import AsyncBatchQueue
 from generating_unit.ifc_generator import IfcGenerator
 
+logger = logging.getLogger("mcc.system")
+_LOG_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARN": logging.WARNING, "ERROR": logging.ERROR}
+
+def file_digest(path: str) -> str:
+    """
+    Content hash of a file, used to key result caches independently of its name.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Detection classes that become columns (graph nodes) in advanced mode.
+# 'person' is kept for the COCO fallback model, matching the simple-mode mapping.
+_STRUCTURAL_CLASSES = frozenset({'column', 'person'})
+
+@dataclass(slots=True)
+class Config:
+    scale: float = 0.05
+    height: float = 3.0
+    floor_count: int = 1
+    conf_threshold: float = 0.25 # Added confidence threshold
+    generation_mode: str = "simple" # "simple" or "advanced"
+    run_ocr: bool = False # OCR each page alongside detection
+
+@dataclass(slots=True)
+class JobContext:
+    file_path: str
+    job_id: str
+    original_filename: str
+
 class SystemStatus(Enum):
     IDLE = "idle"
     PROCESSING = "processing"
@@ -21,25 +62,39 @@ class SystemStatus(Enum):
 
 class SystemManager:
     _instance = None
+    _instance_lock = threading.Lock()
+    DETECTION_CACHE_SIZE = 128
 
     def __new__(cls):
+        return cls.instance()
+
+    @classmethod
+    def instance(cls) -> "SystemManager":
+        """
+        Return the process-wide SystemManager, creating it on first use.
+        The lock keeps concurrent first callers from loading the models twice.
+        """
         if cls._instance is None:
-            cls._instance = super(SystemManager, cls).__new__(cls)
-            cls._instance.initialize()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(SystemManager, cls).__new__(cls)
+                    instance.initialize()
+                    cls._instance = instance
         return cls._instance
 
     def initialize(self):
+        # Idempotent: models and state are only set up once per instance
+        if hasattr(self, "detector"):
+            return
         self.status = SystemStatus.IDLE
-        self.logs = []
+        # Bounded so a long-running server does not grow its log buffer forever
+        self.logs = deque(maxlen=int(os.getenv("LOG_BUFFER", "1000")))
+        # Bumped on every change so readers can cache derived views of config and logs
+        self.logs_version = 0
+        self.config_version = 0
         self.current_job = {}
-        self.last_job_context = {} # Store context for retry/resume
-        self.config = {
-            "scale": 0.05,
-            "height": 3.0,
-            "floor_count": 1,
-            "conf_threshold": 0.25, # Added confidence threshold
-            "generation_mode": "simple" # "simple" or "advanced"
-        }
+        self.last_job_context: Optional[JobContext] = None # Store context for retry/resume
+        self.config = Config()
         
         model_path_env = os.environ.get("YOLO_MODEL_PATH")
         # Check root directory (one level up from backend) and current directory
@@ -53,37 +108,61 @@ class SystemManager:
                 break
         
         model_path = model_path_env if model_path_env else (selected_path if selected_path else default_yolo)
-        self.detector = ObjectDetector(model_path=model_path)
+        # Shared per weights file, so re-initializing the manager does not reload YOLO
+        self.detector = get_detector(model_path)
         self.ocr = OCRExtractor()
+        # Caps concurrent OCR calls on the shared PaddleOCR instance, which is not re-entrant by default
+        self._ocr_slots = threading.BoundedSemaphore(int(os.getenv("OCR_CONCURRENCY", "1")))
+        # Detection requests from concurrent jobs are batched into a single YOLO call
+        self._detection_queue = AsyncBatchQueue(self._detect_batch, max_batch_size=8, max_wait_time=0.1)
+        # Detection results keyed by (file content hash, conf_threshold), so resuming the same
+        # drawing with only generation settings changed skips detection entirely
+        self._detection_cache = OrderedDict()
         
         self.upload_dir = "uploads"
         self.output_dir = "outputs"
         os.makedirs(self.upload_dir, exist_ok=True)
         os.makedirs(self.output_dir, exist_ok=True)
+        # Directory prefixes with the separator, joined once instead of per request
+        self._upload_prefix = os.path.join(self.upload_dir, "")
+        self._output_prefix = os.path.join(self.output_dir, "")
+        # Pay the detector's cold start here rather than on the first request
+        self.detector.warmup()
         self.log("System Initialized. Models Loaded.")
 
     def log(self, message: str, level: str = "INFO"):
-        entry = f"[{time.strftime('%H:%M:%S')}] [{level}] {message}"
-        self.logs.append(entry)
-        print(entry)
+        # The in-memory buffer feeds the chat agent's status replies
+        self.logs.append(f"[{time.strftime('%H:%M:%S')}] [{level}] {message}")
+        self.logs_version += 1
+        lvl = _LOG_LEVELS.get(level, logging.INFO)
+        if logger.isEnabledFor(lvl):
+            logger.log(lvl, "%s", message)
 
-    def update_config(self, key: str, value: Any):
-        self.config[key] = value
+    def update_config(self, key: str, value: Any) -> bool:
+        """
+        Set a config field. Returns False, leaving the config untouched, for unknown keys.
+        """
+        if not hasattr(self.config, key):
+            self.log(f"Unknown config key: {key}", "WARN")
+            return False
+        setattr(self.config, key, value)
+        self.config_version += 1
         self.log(f"Config updated: {key} = {value}")
+        return True
 
     async def resume_workflow(self):
         """
         Resumes the workflow using the last job context.
         """
-        if not self.last_job_context or "file_path" not in self.last_job_context:
+        if self.last_job_context is None:
             self.log("No job context to resume.", "ERROR")
             return {"status": "error", "message": "No job context to resume."}
         
         self.log("Resuming workflow with updated configuration...")
         # Re-run detection and generation
         return await self._execute_processing(
-            self.last_job_context["file_path"],
-            self.last_job_context["job_id"]
+            self.last_job_context.file_path,
+            self.last_job_context.job_id
         )
 
     async def process_workflow(self, file, scale=None, height=None, floor_count=None, generation_mode=None):
@@ -95,22 +174,22 @@ class SystemManager:
         if floor_count is not None: self.update_config("floor_count", floor_count)
         if generation_mode is not None: self.update_config("generation_mode", generation_mode)
 
-        job_id = str(uuid.uuid4())
+        job_id = uuid.uuid4().hex
         self.current_job = {"id": job_id, "step": "init"}
         
         # Save File First
         self.current_job["step"] = "saving_file"
-        file_path = os.path.join(self.upload_dir, f"{job_id}_{file.filename}")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_path = f"{self._upload_prefix}{job_id}_{file.filename}"
+        # Copy in a worker thread so a large upload does not block the event loop
+        await asyncio.to_thread(self._save_upload, file.file, file_path)
         self.log(f"File saved: {file_path}")
 
         # Store context for potential retry
-        self.last_job_context = {
-            "file_path": file_path,
-            "job_id": job_id,
-            "original_filename": file.filename
-        }
+        self.last_job_context = JobContext(
+            file_path=file_path,
+            job_id=job_id,
+            original_filename=file.filename
+        )
         
         return await self._execute_processing(file_path, job_id)
 
@@ -119,18 +198,38 @@ class SystemManager:
         Internal method to execute the core processing logic.
         """
         try:
-            input_paths = [file_path]
-            if file_path.lower().endswith(".pdf"):
-                input_paths = self._convert_pdf_to_images(file_path, job_id)
-            total = 0
-            merged = []
             self.current_job["step"] = "detection"
-            self.log(f"Starting Object Detection with conf={self.config['conf_threshold']}...")
-            for p in input_paths:
-                r = self.detector.predict(p, conf_threshold=self.config['conf_threshold'])
-                total += r["count"]
-                merged.extend(r["detections"])
-            det_results = {"count": total, "detections": merged}
+            conf_threshold = self.config.conf_threshold
+            run_ocr = self.config.run_ocr
+            cache_key = (await asyncio.to_thread(file_digest, file_path), conf_threshold, run_ocr)
+            det_results = self._detection_cache.get(cache_key)
+            if det_results is not None:
+                self._detection_cache.move_to_end(cache_key)
+                self.log(f"Reusing cached detections for conf={conf_threshold}.")
+            else:
+                input_paths = [file_path]
+                if file_path.lower().endswith(".pdf"):
+                    input_paths = self._convert_pdf_to_images(file_path, job_id)
+                total = 0
+                merged = []
+                self.log(f"Starting Object Detection with conf={conf_threshold}...")
+                # Pages share the detection queue with other jobs and are batched together
+                det_task = self._detection_queue.add_requests([(p, conf_threshold) for p in input_paths])
+                if run_ocr:
+                    # CPU-bound OCR overlaps with the GPU-bound detection batch
+                    ocr_task = asyncio.gather(*(asyncio.to_thread(self._ocr_page, p) for p in input_paths))
+                    page_results, ocr_results = await asyncio.gather(det_task, ocr_task)
+                else:
+                    page_results, ocr_results = await det_task, None
+                for r in page_results:
+                    total += r["count"]
+                    merged.extend(r["detections"])
+                det_results = {"count": total, "detections": merged}
+                if ocr_results is not None:
+                    det_results["ocr"] = list(ocr_results)
+                self._detection_cache[cache_key] = det_results
+                if len(self._detection_cache) > self.DETECTION_CACHE_SIZE:
+                    self._detection_cache.popitem(last=False)
             
             # Monitoring / Intervention Point
             if det_results['count'] == 0:
@@ -147,30 +246,9 @@ class SystemManager:
 
             # Step 3: IFC Gen
             self.current_job["step"] = "ifc_generation"
-            self.log(f"Generating IFC Model (Mode: {self.config.get('generation_mode', 'simple')})...")
-            ifc_gen = IfcGenerator(project_name=f"Project_{job_id}")
-            
-            # Use current config
-            scale = self.config["scale"]
-            height = self.config["height"]
-            floor_count = self.config["floor_count"]
-            mode = self.config.get("generation_mode", "simple")
-
-            if mode == "advanced":
-                # Advanced Mode: GNN-based
-                # 1. Clone/Source Model if needed
-                self._ensure_gnn_model()
-                # 2. Run GNN Inference (Mocked for now as we don't have the repo)
-                graph_data = self._run_gnn_inference(file_path, det_results)
-                # 3. Generate Structure
-                ifc_gen.generate_advanced_structure(graph_data, scale, height, floor_count)
-            else:
-                # Simple Mode: Rule-based
-                ifc_gen.generate_simple_extrusion(det_results, scale, height, floor_count)
-            
-            output_filename = f"{job_id}.ifc"
-            output_path = os.path.join(self.output_dir, output_filename)
-            ifc_gen.save(output_path)
+            self.log(f"Generating IFC Model (Mode: {self.config.generation_mode})...")
+            # Generation and STEP serialization are CPU/IO bound, keep them off the event loop
+            output_filename = await asyncio.to_thread(self._generate_ifc, file_path, job_id, det_results)
             
             self.status = SystemStatus.COMPLETED
             self.log(f"Job completed. Output: {output_filename}")
@@ -190,6 +268,87 @@ class SystemManager:
             if self.status != SystemStatus.PAUSED:
                 self.status = SystemStatus.IDLE
 
+    def _generate_ifc(self, file_path: str, job_id: str, det_results: Dict[str, Any]) -> str:
+        """
+        Build the IFC model for a job and write it to the output directory.
+        Returns the output filename.
+        """
+        ifc_gen = IfcGenerator(project_name=f"Project_{job_id}")
+        
+        # Use current config
+        scale = self.config.scale
+        height = self.config.height
+        floor_count = self.config.floor_count
+        mode = self.config.generation_mode
+
+        if mode == "advanced":
+            # Advanced Mode: GNN-based
+            # 1. Clone/Source Model if needed
+            self._ensure_gnn_model()
+            # 2. Run GNN Inference (Mocked for now as we don't have the repo)
+            graph_data = self._run_gnn_inference(file_path, det_results)
+            # 3. Generate Structure
+            ifc_gen.generate_advanced_structure(graph_data, scale, height, floor_count)
+        else:
+            # Simple Mode: Rule-based
+            ifc_gen.generate_simple_extrusion(det_results, scale, height, floor_count)
+        
+        output_filename = f"{job_id}.ifc"
+        output_path = f"{self._output_prefix}{output_filename}"
+        ifc_gen.save(output_path)
+        return output_filename
+
+    def _detect_batch(self, items: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        Run one detection batch for the queue. Items are (image_path, conf_threshold) pairs;
+        each distinct threshold gets its own predict call.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        by_conf: Dict[float, List[int]] = {}
+        for i, (_, conf) in enumerate(items):
+            by_conf.setdefault(conf, []).append(i)
+        for conf, indices in by_conf.items():
+            batch = self.detector.predict_batch([items[i][0] for i in indices], conf_threshold=conf)
+            if len(batch) != len(indices):
+                raise RuntimeError(f"predict_batch returned {len(batch)} results for {len(indices)} images")
+            for i, result in zip(indices, batch):
+                results[i] = result
+        return results
+
+    def _ocr_page(self, image_path: str) -> list:
+        with self._ocr_slots:
+            return self.ocr.extract_text(image_path)
+
+    @staticmethod
+    def _save_upload(src, file_path: str):
+        with open(file_path, "wb") as buffer:
+            # Uploads spooled to disk are copied kernel-side; SpooledTemporaryFile.fileno()
+            # would force an in-memory upload onto disk first, so those take the plain copy.
+            # Only Linux supports file-to-file sendfile, macOS raises ENOTSOCK.
+            if sys.platform.startswith("linux") and getattr(src, "_rolled", True):
+                try:
+                    src_fd = src.fileno()
+                except (AttributeError, OSError, ValueError):
+                    src_fd = None
+                if src_fd is not None:
+                    start = src.tell()
+                    try:
+                        offset = start
+                        remaining = os.fstat(src_fd).st_size - offset
+                        while remaining > 0:
+                            sent = os.sendfile(buffer.fileno(), src_fd, offset, remaining)
+                            if sent == 0:
+                                break
+                            offset += sent
+                            remaining -= sent
+                        return
+                    except OSError:
+                        # Start over with the plain copy below
+                        src.seek(start)
+                        buffer.seek(0)
+                        buffer.truncate()
+            shutil.copyfileobj(src, buffer, 1 << 20)
+
     def _ensure_gnn_model(self):
         """
         Clones the GNN model if not present.
@@ -217,7 +376,7 @@ class SystemManager:
         for i in range(len(doc)):
             page = doc.load_page(i)
             pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), alpha=False)
-            img_path = os.path.join(self.upload_dir, f"{job_id}_page_{i+1}.png")
+            img_path = f"{self._upload_prefix}{job_id}_page_{i+1}.png"
             pix.save(img_path)
             paths.append(img_path)
         doc.close()
@@ -229,18 +388,21 @@ class SystemManager:
         """
         self.log("Running GNN Inference for Structural Connectivity...")
         # Mocking the output of a GNN that connects columns with beams
-        nodes = []
-        for i, det in enumerate(detections['detections']):
-             bbox = det['bbox']
-             width = bbox[2] - bbox[0]
-             depth = bbox[3] - bbox[1]
-             cx = bbox[0] + width / 2
-             cy = bbox[1] + depth / 2
-             nodes.append({'id': i, 'x': cx, 'y': cy, 'width': width, 'depth': depth})
+        # Filter to structural classes before any geometry is computed
+        dets = [det for det in detections['detections'] if det['class'].lower() in _STRUCTURAL_CLASSES]
+        if not dets:
+            return {'nodes': [], 'edges': []}
+
+        # Node geometry for all detections at once: bbox [x1, y1, x2, y2] -> center and size
+        bboxes = np.array([det['bbox'] for det in dets], dtype=np.float64)
+        sizes = bboxes[:, 2:4] - bboxes[:, 0:2]
+        centers = bboxes[:, 0:2] + sizes * 0.5
+        nodes = [
+            {'id': i, 'x': cx, 'y': cy, 'width': width, 'depth': depth}
+            for i, ((cx, cy), (width, depth)) in enumerate(zip(centers.tolist(), sizes.tolist()))
+        ]
         
         # Mock Edges: Connect adjacent nodes
-        edges = []
-        for i in range(len(nodes) - 1):
-            edges.append({'source': i, 'target': i+1})
+        edges = [{'source': i, 'target': i + 1} for i in range(len(nodes) - 1)]
             
         return {'nodes': nodes, 'edges': edges}
@@ -1,38 +1,367 @@
 # This is a placeholder for the Vision Model integration (Qwen3-VL / Claude Sonnet 4.5)
 # Actual implementation requires model weights or API keys.
 
-import requests
-import base64
+import copy
+import logging
 import os
-import torch
-import json
+import asyncio
+import orjson
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import lru_cache
 
-try:
-    # Try importing the specific class first (newer transformers)
-    from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
-    HAS_QWEN_CLASS = True
-except ImportError:
-    # Fallback to generic AutoModel (older transformers)
-    from transformers import AutoModelForCausalLM, AutoProcessor
-    HAS_QWEN_CLASS = False
+# torch, transformers and qwen_vl_utils are imported by _try_import_qwen when a model is about
+# to be loaded, so the regex chat fallback (tests, CPU-only deployments) never pays for them
+torch = None
+AutoProcessor = AutoModelForCausalLM = Qwen2_5_VLForConditionalGeneration = None
+BatchEncoding = TextIteratorStreamer = process_vision_info = None
+HAS_QWEN_CLASS = False
+HAS_QWEN_UTILS = False
+HAS_QWEN = False
+_qwen_import_tried = False
 
-try:
-    from qwen_vl_utils import process_vision_info
-    HAS_QWEN_UTILS = True
-except ImportError:
-    HAS_QWEN_UTILS = False
+def _try_import_qwen() -> bool:
+    """
+    Import the Qwen-VL dependencies into this module on first call and return HAS_QWEN.
+    """
+    global torch, AutoProcessor, AutoModelForCausalLM, Qwen2_5_VLForConditionalGeneration
+    global BatchEncoding, TextIteratorStreamer, process_vision_info
+    global HAS_QWEN_CLASS, HAS_QWEN_UTILS, HAS_QWEN, _qwen_import_tried
+    if _qwen_import_tried:
+        return HAS_QWEN
+    _qwen_import_tried = True
 
-HAS_QWEN = (HAS_QWEN_CLASS or True) and HAS_QWEN_UTILS # AutoModel is always available in modern transformers
+    try:
+        import torch
+        from transformers import AutoProcessor, BatchEncoding
+    except ImportError:
+        return False
 
-from processing_unit.system_manager import SystemManager, SystemStatus
+    try:
+        # Try importing the specific class first (newer transformers)
+        from transformers import Qwen2_5_VLForConditionalGeneration
+        HAS_QWEN_CLASS = True
+    except ImportError:
+        # Fallback to generic AutoModel (older transformers)
+        from transformers import AutoModelForCausalLM
+        HAS_QWEN_CLASS = False
+
+    try:
+        from transformers import TextIteratorStreamer
+    except ImportError:
+        TextIteratorStreamer = None
+
+    try:
+        from qwen_vl_utils import process_vision_info
+        HAS_QWEN_UTILS = True
+    except ImportError:
+        HAS_QWEN_UTILS = False
+
+    HAS_QWEN = (HAS_QWEN_CLASS or True) and HAS_QWEN_UTILS # AutoModel is always available in modern transformers
+    return HAS_QWEN
+
+from processing_unit.system_manager import SystemManager, SystemStatus, file_digest
+from processing_unit.batch_queue import AsyncBatchQueue
+
+logger = logging.getLogger("mcc.vision")
+
+# Every intent of the regex chat fallback as one alternation, so a message is scanned once.
+# Matches are dispatched on match.lastgroup, which is the outer named group of each branch.
+# Case-insensitive, so messages are matched as typed without a lowercased copy.
+# Keywords only match whole words, so "paragraph" or "basically" carry no intent.
+# The conf value is captured in a lookahead, so the same number can still be read as a
+# floor count (e.g. "conf 3 floors").
+_CHAT_RE = re.compile(
+    r"(?P<status>\b(?:status|what is happening)\b)"
+    r"|(?P<floor>(?<![\d.])\b(?P<floor_count>\d+)\s*floors?\b)"
+    r"|(?P<conf>\b(?:threshold|conf|confidence)\s*(?:to|is|=)?\s*(?=(?P<conf_value>[0-9]*\.?[0-9]+)))"
+    r"|(?P<advanced>\b(?:advanced|gnn|graph)\b)"
+    r"|(?P<simple>\b(?:simple|rule|basic)\b)"
+    r"|(?P<retry>\b(?:retry|resume|try again)\b)",
+    re.IGNORECASE
+)
+
+def _chat_hits(message: str) -> dict:
+    """
+    First match of each intent, from a single pass over the message.
+    """
+    hits = {}
+    for m in _CHAT_RE.finditer(message):
+        hits.setdefault(m.lastgroup, m)
+    return hits
+# Keywords for the missing-value clarifications, mapped to tags and found in one scan
+_KEYWORD_TAGS = {
+    "floor": "FLOOR",
+    "threshold": "CONF",
+    "confidence": "CONF",
+    "set": "EDIT",
+    "change": "EDIT",
+}
+_KEYWORD_RE = re.compile("|".join(re.escape(kw) for kw in sorted(_KEYWORD_TAGS, key=len, reverse=True)), re.IGNORECASE)
+
+# Action block appended by the agent model
+_JSON_RE = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+# Common slips in model-written JSON: trailing commas and single-quoted strings
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SINGLE_QUOTED_RE = re.compile(r"'([^'\"]*)'")
+
+def _parse_action(block: str) -> dict:
+    """
+    Parse the agent's JSON action block, retrying once with trailing commas dropped and
+    single quotes turned into double quotes. Raises orjson.JSONDecodeError if still invalid.
+    """
+    try:
+        return orjson.loads(block)
+    except orjson.JSONDecodeError:
+        repaired = _TRAILING_COMMA_RE.sub(r"\1", _SINGLE_QUOTED_RE.sub(r'"\1"', block))
+        return orjson.loads(repaired)
+
+# Stand-in user message used to split the chat template into the text before and after it
+_USER_SENTINEL = "\x00USER_MESSAGE\x00"
+
+SYSTEM_PROMPT = "You are the System Manager for the MCC AI Concrete Structure Construction system. Your goal is to assist the user in managing the workflow, updating configurations, and resolving errors. Be concise and helpful."
+
+# Short greedy decodes: no sampling, no beams, KV cache on
+GREEDY_GENERATION = {"do_sample": False, "num_beams": 1, "use_cache": True}
+
+# Prompt lengths are left-padded up to one of these when the forward is compiled, so the
+# compiled graphs are reused instead of recompiled for every new length
+PROMPT_BUCKETS = (512, 1024, 2048)
+
+def _compile_enabled() -> bool:
+    """
+    torch.compile of the Qwen-VL forward is opt-in (QWEN_COMPILE=1) and CUDA only; the first
+    generation per bucket pays the compile time.
+    """
+    return os.environ.get("QWEN_COMPILE", "0") == "1" and torch.cuda.is_available()
+
+def _zero_rope_deltas(model, batch_size: int, device):
+    """
+    Qwen2.5-VL keeps the M-RoPE offset of its last prompt on the model and reuses it whenever
+    generation starts from a non-empty cache. Text-only prompts have no offset, so reset it to
+    zero before continuing from a cached text prefix (a stale image offset would shift positions).
+    """
+    zero = torch.zeros((batch_size, 1), dtype=torch.long, device=device)
+    for owner in (model, getattr(model, "model", None)):
+        if owner is not None and hasattr(owner, "rope_deltas"):
+            owner.rope_deltas = zero
+
+def _qwen_dtype():
+    """
+    Half precision on GPU (bf16 where supported, otherwise fp16); CPU keeps the checkpoint dtype.
+    """
+    if torch.cuda.is_available():
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    return "auto"
+
+def _attn_implementation():
+    """
+    FlashAttention-2 on Ampere or newer GPUs when flash-attn is installed, otherwise PyTorch SDPA.
+    """
+    if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8:
+        try:
+            import flash_attn  # noqa: F401
+            return "flash_attention_2"
+        except ImportError:
+            pass
+    return "sdpa"
+
+def _load_qwen_weights(path: str, torch_dtype):
+    # Use Qwen2_5_VLForConditionalGeneration or fall back to AutoModel if using a different variant
+    # Added trust_remote_code=True for newer/custom models like Qwen3-Thinking
+    if HAS_QWEN_CLASS:
+        model_cls = Qwen2_5_VLForConditionalGeneration
+    else:
+        # Fallback for older transformers versions
+        model_cls = AutoModelForCausalLM
+
+    model = model_cls.from_pretrained(
+        path, 
+        torch_dtype=torch_dtype, 
+        device_map="auto",
+        attn_implementation=_attn_implementation(),
+        # Weights are always on local disk: skip the random init and any hub lookups
+        low_cpu_mem_usage=True,
+        local_files_only=True,
+        trust_remote_code=True
+    )
+    processor = AutoProcessor.from_pretrained(path, local_files_only=True, trust_remote_code=True)
+    return model, processor
+
+def _fp8_mode():
+    """
+    The QWEN_QUANT FP8 mode ("fp8" or "fp8-int8"), or None when it is off or the GPU
+    has no FP8 tensor cores (compute capability < 8.9).
+    """
+    mode = os.environ.get("QWEN_QUANT", "fp8").lower()
+    if mode not in ("fp8", "fp8-int8"):
+        return None
+    if not torch.cuda.is_available() or torch.cuda.get_device_capability() < (8, 9):
+        return None
+    return mode
+
+def _fp8_checkpoint(path: str):
+    """
+    Return an FP8 (W8A8, dynamic per-token activations) copy of the checkpoint at `path`,
+    quantizing it with llm-compressor on first use. With QWEN_QUANT="fp8" only the language
+    model is quantized; "fp8-int8" also quantizes the vision tower's linear layers to int8
+    (W8A8, dynamic activations). Returns None for any other QWEN_QUANT value, when the GPU has
+    no FP8 tensor cores (compute capability < 8.9) or quantization is unavailable.
+    """
+    mode = _fp8_mode()
+    if mode is None:
+        return None
+
+    fp8_path = path.rstrip("/\\") + ("-FP8-Dynamic" if mode == "fp8" else "-FP8-INT8ViT")
+    if os.path.isdir(fp8_path):
+        return fp8_path
+
+    try:
+        try:
+            from llmcompressor import oneshot
+        except ImportError:
+            from llmcompressor.transformers import oneshot
+        from llmcompressor.modifiers.quantization import QuantizationModifier
+    except ImportError:
+        logger.warning("llm-compressor not installed, loading Qwen-VL without FP8 quantization.")
+        return None
+
+    try:
+        logger.info("Quantizing Qwen-VL to FP8 into %s (one-time)...", fp8_path)
+        model, processor = _load_qwen_weights(path, "auto")
+        if mode == "fp8":
+            # Linear layers only; the vision tower and lm_head stay in their original precision
+            recipe = QuantizationModifier(targets="Linear", scheme="FP8_DYNAMIC", ignore=["re:.*lm_head", "re:.*visual.*"])
+        else:
+            from compressed_tensors.quantization import preset_name_to_scheme
+
+            # Decoder projections in FP8, vision transformer blocks in int8; lm_head, the patch
+            # embedding and the vision merger stay in their original precision
+            recipe = QuantizationModifier(
+                config_groups={
+                    "language_model": preset_name_to_scheme("FP8_DYNAMIC", ["re:.*layers\\.\\d+\\..*_proj$"]),
+                    "vision_tower": preset_name_to_scheme("W8A8", ["re:.*visual\\.blocks\\.\\d+\\..*(qkv|proj)$"]),
+                },
+                ignore=["re:.*lm_head"]
+            )
+        oneshot(model=model, recipe=recipe)
+        model.save_pretrained(fp8_path)
+        processor.save_pretrained(fp8_path)
+        del model
+        torch.cuda.empty_cache()
+        return fp8_path
+    except Exception as e:
+        logger.warning("FP8 quantization failed, using the original weights: %s", e)
+        return None
+
+@lru_cache(maxsize=32)
+def _load_image(path: str, mtime: float):
+    """
+    Decoded RGB image for a drawing, keyed by mtime so an overwritten file is reloaded.
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.convert("RGB")
+
+@lru_cache(maxsize=1)
+def _get_qwen(path: str):
+    """
+    Load the Qwen-VL model and processor once per process and share them between reasoners.
+    Prefers the FP8 checkpoint where supported, see _fp8_checkpoint.
+    Failed loads raise and are not cached, so a later call can retry.
+    """
+    fp8_path = _fp8_checkpoint(path)
+    if fp8_path is not None:
+        try:
+            model, processor = _load_qwen_weights(fp8_path, "auto")
+        except Exception as e:
+            logger.warning("Error loading FP8 Qwen-VL, falling back to %s: %s", path, e)
+            fp8_path = None
+    if fp8_path is None:
+        model, processor = _load_qwen_weights(path, _qwen_dtype())
+
+    if _compile_enabled():
+        # CUDA graphs remove the per-step launch overhead of the decode loop. Compiled
+        # generations run on a static KV cache (see VisionReasoner._compiled_cache_kwargs),
+        # so decode steps keep one shape and don't recompile as the cache grows
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", dynamic=False)
+    return model, processor
+
+@lru_cache(maxsize=1)
+def _get_vllm(path: str):
+    """
+    Start a vLLM engine on the local Qwen-VL weights, once per process.
+    Paged KV cache with prefix caching, so the fixed system prompt is prefilled once.
+    Serves the same FP8 checkpoint as _get_qwen; vLLM reads its compressed-tensors scheme
+    from the checkpoint config. Without one, QWEN_QUANT="fp8" falls back to vLLM's own
+    dynamic FP8 quantization of the original weights.
+    The HF processor is kept for chat templates.
+    """
+    from vllm import LLM
+
+    engine_args = dict(
+        dtype="auto",
+        max_model_len=4096,
+        enable_prefix_caching=True,
+        limit_mm_per_prompt={"image": 1},
+        trust_remote_code=True
+    )
+    fp8_path = _fp8_checkpoint(path)
+    llm = None
+    if fp8_path is not None:
+        try:
+            llm = LLM(model=fp8_path, **engine_args)
+            path = fp8_path
+        except Exception as e:
+            logger.warning("Error loading FP8 Qwen-VL in vLLM, falling back to %s: %s", path, e)
+    if llm is None:
+        if _fp8_mode() == "fp8":
+            engine_args["quantization"] = "fp8"
+        llm = LLM(model=path, **engine_args)
+    processor = AutoProcessor.from_pretrained(path, local_files_only=True, trust_remote_code=True)
+    return llm, processor
+
+class JsonFenceStopping:
+    """
+    Stops an agent reply once its ```json action block is closed, nothing after it is used.
+    Follows the transformers StoppingCriteria call signature (transformers is imported lazily,
+    so this is a plain callable rather than a subclass).
+    """
+
+    def __init__(self, tokenizer, fence_ids: frozenset, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.fence_ids = fence_ids
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row in input_ids:
+            # A block can only close on a token containing a backtick, only then decode the reply
+            closed = int(row[-1]) in self.fence_ids and _JSON_RE.search(
+                self.tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True)) is not None
+            done.append(closed)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+@lru_cache(maxsize=4)
+def _fence_token_ids(tokenizer) -> frozenset:
+    """
+    Ids of vocabulary tokens containing a backtick. Byte-level BPE keeps printable ASCII as is,
+    so the raw token strings can be checked without decoding each one.
+    """
+    return frozenset(token_id for token, token_id in tokenizer.get_vocab().items() if "`" in token)
 
 class VisionReasoner:
+    ANALYSIS_CACHE_SIZE = 64
+    TOKEN_CACHE_SIZE = 128
+
     def __init__(self, system=None, model_type: str = "qwen-vl"):
         self.model_type = model_type
         # Allow injecting a system instance (useful for testing or shared state)
         # If none provided, use the singleton SystemManager
-        self.system = system if system else SystemManager() 
+        self.system = system if system else SystemManager.instance() 
         
         self.model = None
         self.processor = None
@@ -42,83 +371,321 @@ class VisionReasoner:
         # Users can update this path to their local download of Qwen-VL
         # Defaulting to Qwen2.5-VL-3B-Instruct for efficiency
         self.local_model_path = os.environ.get("QWEN_MODEL_PATH", "../models/Qwen2.5-VL-3B-Instruct")
+        # "hf" runs transformers generate, "vllm" serves the same weights through vLLM
+        self.backend = os.environ.get("QWEN_BACKEND", "hf").lower()
         
         self.is_model_loaded = False
+        # VLM outputs keyed by (image content hash, prompt), oldest entries evicted first
+        self._analysis_cache = OrderedDict()
+        # Rendered chat templates keyed by prompt
+        self._prompt_template_cache = OrderedDict()
+        # CPU (input_ids, attention_mask) of agent chat turns keyed by prompt. The prompt embeds
+        # status, config and recent logs, so a repeated message in an unchanged state hits
+        self._token_cache = OrderedDict()
+        # Side stream for host-to-device input copies, created on first CUDA use
+        self._copy_stream = None
+        # Token ids and KV cache of the system prompt, prefilled once (HF backend)
+        self._prefix_ids = None
+        self._prefix_kv = None
+        # System turn token ids (CPU) and the template text around a user message, see _pretokenize_system
+        self._system_ids = None
+        self._user_template = None
+        # Set when the HF forward is compiled; prompts are then padded to PROMPT_BUCKETS
+        self.compiled = False
+        # (version, text) snapshots of the system config and recent logs for the agent prompt
+        self._config_snapshot = (-1, "")
+        self._logs_snapshot = (-1, "")
+        # Single worker that runs every agent generation, so the event loop never blocks on
+        # generate and concurrent turns don't oversubscribe the GPU
+        self._exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qwen")
+        # Chat turns arriving within 50 ms of each other share one generate call
+        self._chat_queue = AsyncBatchQueue(self._generate_agent_batch, max_batch_size=8, max_wait_time=0.05, executor=self._exec)
         self._load_local_qwen()
 
     def _load_local_qwen(self):
         """
         Loads the Qwen2.5-VL model from the local path if available.
         """
-        if not HAS_QWEN:
-            print("Warning: Qwen dependencies not installed. Please run `pip install -r requirements.txt`.")
+        if not _try_import_qwen():
+            logger.warning("Qwen dependencies not installed. Please run `pip install -r requirements.txt`.")
             return
 
         if os.path.exists(self.local_model_path):
-            print(f"Loading Qwen-VL from {self.local_model_path}...")
+            logger.info("Loading Qwen-VL from %s...", self.local_model_path)
             try:
-                # Use Qwen2_5_VLForConditionalGeneration or fall back to AutoModel if using a different variant
-                # Added trust_remote_code=True for newer/custom models like Qwen3-Thinking
-                if HAS_QWEN_CLASS:
-                    model_cls = Qwen2_5_VLForConditionalGeneration
-                else:
-                    # Fallback for older transformers versions
-                    model_cls = AutoModelForCausalLM
-
-                self.model = model_cls.from_pretrained(
-                    self.local_model_path, 
-                    torch_dtype="auto", 
-                    device_map="auto",
-                    trust_remote_code=True
-                )
-                self.processor = AutoProcessor.from_pretrained(self.local_model_path, trust_remote_code=True)
+                # Weights are shared across VisionReasoner instances, only the first one pays for the load
+                if self.backend == "vllm":
+                    try:
+                        self.model, self.processor = _get_vllm(self.local_model_path)
+                    except ImportError:
+                        logger.warning("vLLM not installed, falling back to the transformers backend.")
+                        self.backend = "hf"
+                if self.backend != "vllm":
+                    self.model, self.processor = _get_qwen(self.local_model_path)
+                    self.compiled = _compile_enabled()
+                    self._pretokenize_system()
                 self.is_model_loaded = True
-                print("Qwen-VL loaded successfully.")
+                logger.info("Qwen-VL loaded successfully.")
             except Exception as e:
-                print(f"Error loading Qwen-VL: {e}")
+                logger.error("Error loading Qwen-VL: %s", e)
                 self.is_model_loaded = False
         else:
-            print(f"Qwen-VL model path not found at: {self.local_model_path}")
+            logger.warning("Qwen-VL model path not found at: %s", self.local_model_path)
+
+    def _to_device(self, inputs):
+        """
+        Move processor outputs to the model device. On CUDA the tensors are pinned and copied
+        asynchronously on a side stream, and the compute stream waits for the copy to finish.
+        A compiled model copies on the compute stream itself, the stream its CUDA graphs run on.
+        """
+        device = self.model.device
+        if device.type != "cuda":
+            return inputs.to(device)
+        if self.compiled:
+            for key, value in inputs.items():
+                if isinstance(value, torch.Tensor):
+                    inputs[key] = value.pin_memory().to(device, non_blocking=True)
+            return inputs
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream(device=device)
+        compute_stream = torch.cuda.current_stream(device)
+        with torch.cuda.stream(self._copy_stream):
+            for key, value in inputs.items():
+                if isinstance(value, torch.Tensor):
+                    value = value.pin_memory().to(device, non_blocking=True)
+                    # Tell the allocator the tensor is used on the compute stream as well
+                    value.record_stream(compute_stream)
+                    inputs[key] = value
+        compute_stream.wait_stream(self._copy_stream)
+        return inputs
+
+    def _json_stopping(self, inputs) -> list:
+        return [JsonFenceStopping(self.processor.tokenizer, _fence_token_ids(self.processor.tokenizer),
+                                  inputs["input_ids"].shape[1])]
+
+    def _compiled_cache_kwargs(self) -> dict:
+        """
+        generate kwargs for a compiled forward: a static KV cache, preallocated to the bucketed
+        prompt length plus max_new_tokens, instead of the DynamicCache that grows every step.
+        """
+        return {"cache_implementation": "static"} if self.compiled else {}
+
+    def _pad_to_bucket(self, inputs):
+        """
+        Left-pad input_ids and attention_mask up to the next PROMPT_BUCKETS length.
+        Prompts longer than the largest bucket are left as they are.
+        """
+        length = inputs["input_ids"].shape[1]
+        target = next((bucket for bucket in PROMPT_BUCKETS if bucket >= length), length)
+        if target == length:
+            return inputs
+        tokenizer = self.processor.tokenizer
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        inputs["input_ids"] = torch.nn.functional.pad(inputs["input_ids"], (target - length, 0), value=pad_id)
+        inputs["attention_mask"] = torch.nn.functional.pad(inputs["attention_mask"], (target - length, 0), value=0)
+        return inputs
+
+    def _generate_vllm(self, text: str, max_tokens: int, image=None) -> str:
+        """
+        Greedy generation through the vLLM engine, matching GREEDY_GENERATION on the HF path.
+        """
+        from vllm import SamplingParams
+
+        request = {"prompt": text}
+        if image is not None:
+            request["multi_modal_data"] = {"image": image}
+        outputs = self.model.generate([request], sampling_params=SamplingParams(max_tokens=max_tokens, temperature=0.0),
+                                      use_tqdm=False)
+        return outputs[0].outputs[0].text
+
+    def _pretokenize_system(self):
+        """
+        Tokenize the fixed system turn once and split the rendered chat template around a
+        user message, so a chat turn only formats and tokenizes its own part of the prompt.
+        Leaves both unset (full rendering per turn) if the template doesn't split cleanly.
+        """
+        try:
+            system_text = self.processor.apply_chat_template([{"role": "system", "content": SYSTEM_PROMPT}], tokenize=False)
+            full_text = self._agent_text(_USER_SENTINEL)
+            if not full_text.startswith(system_text) or full_text.count(_USER_SENTINEL) != 1:
+                return
+            head, tail = full_text[len(system_text):].split(_USER_SENTINEL)
+            self._system_ids = self.processor.tokenizer(system_text, return_tensors="pt").input_ids
+            self._user_template = (head, tail)
+        except Exception as e:
+            logger.warning("Could not pre-tokenize the system prompt: %s", e)
+
+    def _system_prefix(self):
+        """
+        Prefill the system prompt once and keep its ids and KV cache for later chat turns.
+        """
+        if self._prefix_kv is None:
+            if self._system_ids is not None:
+                prefix_ids = self._system_ids.to(self.model.device)
+            else:
+                text = self.processor.apply_chat_template([{"role": "system", "content": SYSTEM_PROMPT}], tokenize=False)
+                prefix_ids = self.processor.tokenizer(text, return_tensors="pt").input_ids.to(self.model.device)
+            with torch.inference_mode():
+                self._prefix_kv = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+            self._prefix_ids = prefix_ids
+        return self._prefix_ids, self._prefix_kv
+
+    def _agent_text(self, prompt: str) -> str:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        return self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def _agent_inputs(self, prompt: str):
+        """
+        Tokenize one chat turn for the HF backend and return (inputs, cache_kwargs).
+        Only the user turn is tokenized, behind the pre-tokenized system ids.
+        """
+        tokens = self._token_cache.get(prompt)
+        if tokens is not None:
+            self._token_cache.move_to_end(prompt)
+        else:
+            if self._user_template is not None:
+                head, tail = self._user_template
+                user_ids = self.processor.tokenizer(head + prompt + tail, add_special_tokens=False, return_tensors="pt").input_ids
+                input_ids = torch.cat([self._system_ids, user_ids], dim=1)
+                tokens = (input_ids, torch.ones_like(input_ids))
+            else:
+                encoded = self.processor(
+                    text=[self._agent_text(prompt)],
+                    padding=True,
+                    return_tensors="pt"
+                )
+                tokens = (encoded["input_ids"], encoded["attention_mask"])
+            self._token_cache[prompt] = tokens
+            if len(self._token_cache) > self.TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        # Fresh container per call, the device copy and padding replace its entries
+        inputs = BatchEncoding({"input_ids": tokens[0], "attention_mask": tokens[1]})
+        if self.compiled:
+            # Bucketed shapes for the compiled forward; the padding rules out the prefix cache
+            return self._to_device(self._pad_to_bucket(inputs)), self._compiled_cache_kwargs()
+        cache_kwargs = {}
+        inputs = self._to_device(inputs)
+
+        # Continue from the cached system prompt so only the per-turn tail is prefilled.
+        # generate extends the cache in place, so each turn works on its own copy.
+        try:
+            prefix_ids, prefix_kv = self._system_prefix()
+            prefix_len = prefix_ids.shape[1]
+            if inputs.input_ids.shape[1] > prefix_len and torch.equal(inputs.input_ids[0, :prefix_len], prefix_ids[0]):
+                _zero_rope_deltas(self.model, 1, self.model.device)
+                cache_kwargs["past_key_values"] = copy.deepcopy(prefix_kv)
+        except Exception as e:
+            logger.warning("System prompt cache unavailable, prefilling in full: %s", e)
+        return inputs, cache_kwargs
 
     def _generate_agent_response(self, prompt: str):
         try:
-            messages = [
-                {"role": "system", "content": "You are the System Manager for the MCC AI Concrete Structure Construction system. Your goal is to assist the user in managing the workflow, updating configurations, and resolving errors. Be concise and helpful."},
-                {"role": "user", "content": prompt}
-            ]
-            text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-            inputs = self.processor(
-                text=[text],
-                padding=True,
-                return_tensors="pt"
-            )
-            inputs = inputs.to(self.model.device)
+            if self.backend == "vllm":
+                return self._generate_vllm(self._agent_text(prompt), max_tokens=256)
+            inputs, cache_kwargs = self._agent_inputs(prompt)
             
-            # Generate response
-            generated_ids = self.model.generate(**inputs, max_new_tokens=256)
+            # Generate response, greedy and without autograd bookkeeping
+            with torch.inference_mode():
+                generated_ids = self.model.generate(**inputs, max_new_tokens=256, stopping_criteria=self._json_stopping(inputs),
+                                                    **GREEDY_GENERATION, **cache_kwargs)
             
-            # Decode only the new tokens
-            generated_ids = [
-                output_ids[len(input_ids):] for input_ids, output_ids in zip(inputs.input_ids, generated_ids)
-            ]
+                # Decode only the new tokens
+                generated_ids = [
+                    output_ids[len(input_ids):] for input_ids, output_ids in zip(inputs.input_ids, generated_ids)
+                ]
             output_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
             return output_text
         except Exception as e:
-            print(f"Error in agent generation: {e}")
+            logger.error("Error in agent generation: %s", e)
             return None
 
-    async def chat_with_user(self, message: str) -> dict:
+    def _generate_agent_batch(self, prompts: list) -> list:
         """
-        Process a text message from the user, simulating a VL/LLM agent (RPA Manager).
-        It can inspect system state and trigger actions.
+        Generate replies for several chat prompts in one padded batch.
+        A single prompt takes the regular path, which can reuse the system prompt cache.
         """
-        if not self.is_model_loaded:
-            return await self._chat_fallback_regex(message)
+        if len(prompts) == 1:
+            return [self._generate_agent_response(prompts[0])]
+        try:
+            texts = [
+                self.processor.apply_chat_template(
+                    [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+                    tokenize=False, add_generation_prompt=True)
+                for prompt in prompts
+            ]
+            if self.backend == "vllm":
+                from vllm import SamplingParams
+
+                outputs = self.model.generate([{"prompt": text} for text in texts],
+                                              sampling_params=SamplingParams(max_tokens=256, temperature=0.0),
+                                              use_tqdm=False)
+                return [output.outputs[0].text for output in outputs]
+
+            # Left padding lines every prompt up to end at the same column, where generation starts.
+            # The tokenizer is shared, so its padding side is restored for later single-turn calls.
+            tokenizer = self.processor.tokenizer
+            padding_side = tokenizer.padding_side
+            tokenizer.padding_side = "left"
+            try:
+                inputs = self.processor(text=texts, padding=True, return_tensors="pt")
+            finally:
+                tokenizer.padding_side = padding_side
+            if self.compiled:
+                inputs = self._pad_to_bucket(inputs)
+            inputs = self._to_device(inputs)
+            with torch.inference_mode():
+                generated_ids = self.model.generate(**inputs, max_new_tokens=256, stopping_criteria=self._json_stopping(inputs),
+                                                    **GREEDY_GENERATION, **self._compiled_cache_kwargs())
+            return self.processor.batch_decode(generated_ids[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
+        except Exception as e:
+            logger.error("Error in batched agent generation: %s", e)
+            return [None] * len(prompts)
 
+    def _state_snapshot(self):
+        """
+        Serialized config and the last three log lines, rebuilt only when the system's
+        config_version / logs_version has moved since the previous chat turn.
+        """
+        if self._config_snapshot[0] != self.system.config_version:
+            self._config_snapshot = (self.system.config_version, orjson.dumps(asdict(self.system.config)).decode())
+        if self._logs_snapshot[0] != self.system.logs_version:
+            # Index from the end instead of slicing, logs is a deque
+            logs = self.system.logs
+            recent_logs = "\n".join(logs[i] for i in range(-min(3, len(logs)), 0)) if logs else "No logs yet."
+            self._logs_snapshot = (self.system.logs_version, recent_logs)
+        return self._config_snapshot[1], self._logs_snapshot[1]
+
+    def _stream_agent_response(self, prompt: str):
+        """
+        Queue generation for one chat turn on the generation worker and return an iterator over
+        the decoded text as it is produced. The vLLM backend yields the whole reply at once.
+        """
+        if self.backend == "vllm" or TextIteratorStreamer is None:
+            return iter([self._generate_agent_response(prompt) or ""])
+
+        inputs, cache_kwargs = self._agent_inputs(prompt)
+        streamer = TextIteratorStreamer(self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def generate():
+            try:
+                with torch.inference_mode():
+                    self.model.generate(**inputs, max_new_tokens=256, streamer=streamer, stopping_criteria=self._json_stopping(inputs),
+                                        **GREEDY_GENERATION, **cache_kwargs)
+            except Exception as e:
+                logger.error("Error in streamed agent generation: %s", e)
+                # Unblock the consumer
+                streamer.end()
+
+        self._exec.submit(generate)
+        return streamer
+
+    def _agent_prompt(self, message: str) -> str:
         # 1. Build Agent Context
         status = self.system.status.value
-        config_str = json.dumps(self.system.config)
-        recent_logs = "\n".join(self.system.logs[-3:]) if self.system.logs else "No logs yet."
+        config_str, recent_logs = self._state_snapshot()
         
         prompt = f"""
 Current System State:
@@ -156,12 +723,74 @@ OR
 }}
 ```
 """
-        # Generate response
-        response_text = self._generate_agent_response(prompt)
+        return prompt
+
+    @staticmethod
+    def _intent_matched(message: str) -> bool:
+        """
+        True when _chat_fallback_regex would fully handle the message: an explicit status or
+        retry command, or a parameter update (floor count, mode, valid threshold). Those are
+        answered without running the agent model; everything else goes to the agent.
+        """
+        hits = _chat_hits(message)
+        if hits.keys() & {"status", "retry", "floor", "advanced", "simple"}:
+            return True
+        conf_match = hits.get("conf")
+        if conf_match:
+            try:
+                return 0 < float(conf_match.group("conf_value")) < 1.0
+            except ValueError:
+                return False
+        return False
+
+    async def chat_with_user(self, message: str) -> dict:
+        """
+        Process a text message from the user, simulating a VL/LLM agent (RPA Manager).
+        It can inspect system state and trigger actions.
+        """
+        if not self.is_model_loaded or self._intent_matched(message):
+            return await self._chat_fallback_regex(message)
+
+        # Generate response, batched with any other chat turns in flight
+        response_text = await self._chat_queue.add_request(self._agent_prompt(message))
         
         if not response_text:
-             return self._chat_fallback_regex(message)
+             return await self._chat_fallback_regex(message)
 
+        return await self._apply_agent_reply(response_text)
+
+    async def chat_with_user_stream(self, message: str):
+        """
+        Streaming variant of chat_with_user. Yields {"delta": text} events while the agent
+        generates, then one final event with "done": True and the same fields chat_with_user
+        returns. The action block is only parsed once the full reply is in.
+        """
+        if not self.is_model_loaded or self._intent_matched(message):
+            yield {"done": True, **await self._chat_fallback_regex(message)}
+            return
+
+        chunks = []
+        try:
+            loop = asyncio.get_running_loop()
+            stream = await loop.run_in_executor(self._exec, self._stream_agent_response, self._agent_prompt(message))
+            # The streamer blocks between tokens, so pull each chunk off the event loop
+            while (chunk := await asyncio.to_thread(next, stream, None)) is not None:
+                if chunk:
+                    chunks.append(chunk)
+                    yield {"delta": chunk}
+        except Exception as e:
+            logger.error("Error in streamed agent generation: %s", e)
+
+        response_text = "".join(chunks)
+        if not response_text:
+            yield {"done": True, **await self._chat_fallback_regex(message)}
+            return
+        yield {"done": True, **await self._apply_agent_reply(response_text)}
+
+    async def _apply_agent_reply(self, response_text: str) -> dict:
+        """
+        Strip the JSON action block from a complete agent reply and carry out the action.
+        """
         # Parse Response
         response = {
             "reply": response_text,
@@ -169,18 +798,18 @@ OR
         }
         
         # Extract JSON if present
-        json_match = re.search(r"```json\s*(\{.*?\})\s*```", response_text, re.DOTALL)
+        json_match = _JSON_RE.search(response_text)
         if json_match:
             try:
-                action_data = json.loads(json_match.group(1))
+                action_data = _parse_action(json_match.group(1))
                 # Remove the JSON block from the reply to keep it clean for the user
                 response["reply"] = response_text.replace(json_match.group(0), "").strip()
                 
                 if action_data.get("action") == "update_config":
                     key = action_data.get("key")
                     val = action_data.get("value")
-                    if key and val is not None:
-                        self.system.update_config(key, val)
+                    # Only report keys the system manager actually applied
+                    if key and val is not None and self.system.update_config(key, val):
                         response["updated_params"][key] = val
                         
                 elif action_data.get("action") == "command":
@@ -193,7 +822,7 @@ OR
                             response["reply"] += f"\n[System] Failed: {result.get('message')}"
                             
             except Exception as e:
-                print(f"Failed to parse agent action: {e}")
+                logger.warning("Failed to parse agent action: %s", e)
 
         return response
 
@@ -202,14 +831,16 @@ OR
         Original regex-based implementation for fallback.
         Now async to support workflow control.
         """
-        message_lower = message.lower()
         response = {
             "reply": "I received your message.",
             "updated_params": {}
         }
         
+        hits = _chat_hits(message)
+        tags = {_KEYWORD_TAGS[m.group().lower()] for m in _KEYWORD_RE.finditer(message)}
+        
         # 1. System Status Check
-        if "status" in message_lower or "what is happening" in message_lower:
+        if "status" in hits:
             status = self.system.status.value
             last_log = self.system.logs[-1] if self.system.logs else "No logs yet."
             response["reply"] = f"Manager: Current System Status is [{status.upper()}].\nLast Activity: {last_log}"
@@ -218,28 +849,28 @@ OR
         # 2. Configuration Updates
         
         # Floor Count
-        floor_match = re.search(r"(\d+)\s*floor", message_lower)
+        floor_match = hits.get("floor")
         if floor_match:
-            count = int(floor_match.group(1))
+            count = int(floor_match.group("floor_count"))
             self.system.update_config("floor_count", count)
             response["updated_params"]["floor_count"] = count
             response["reply"] = f"Manager: I've updated the plan to {count} floors."
 
         # Generation Mode (Simple vs Advanced)
-        if "advanced" in message_lower or "gnn" in message_lower or "graph" in message_lower:
+        if "advanced" in hits:
             self.system.update_config("generation_mode", "advanced")
             response["updated_params"]["generation_mode"] = "advanced"
             response["reply"] = "Manager: Switched to Advanced Mode (GNN-based Structural Reconstruction)."
-        elif "simple" in message_lower or "rule" in message_lower or "basic" in message_lower:
+        elif "simple" in hits:
             self.system.update_config("generation_mode", "simple")
             response["updated_params"]["generation_mode"] = "simple"
             response["reply"] = "Manager: Switched to Simple Mode (Rule-based Extrusion)."
 
         # Confidence Threshold
-        conf_match = re.search(r"(?:threshold|conf|confidence)\s*(?:to|is|=)?\s*([0-9]*\.?[0-9]+)", message_lower)
+        conf_match = hits.get("conf")
         if conf_match:
             try:
-                val = float(conf_match.group(1))
+                val = float(conf_match.group("conf_value"))
                 if 0 < val < 1.0:
                     self.system.update_config("conf_threshold", val)
                     response["updated_params"]["conf_threshold"] = val
@@ -250,7 +881,7 @@ OR
                 pass
 
         # 3. Intervention / Workflow Control 
-        if "retry" in message_lower or "resume" in message_lower or "try again" in message_lower: 
+        if "retry" in hits: 
             if self.system.status == SystemStatus.PAUSED: 
                 response["reply"] = "Manager: Resuming workflow with the current settings..." 
                 result = await self.system.resume_workflow() 
@@ -267,10 +898,10 @@ OR
                 return response
 
         # 4. Proactive Clarification & Safety Checks
-        elif "floor" in message_lower and not response["updated_params"] and ("set" in message_lower or "change" in message_lower):
+        elif "FLOOR" in tags and not response["updated_params"] and "EDIT" in tags:
             response["reply"] = "Manager: You mentioned setting the floor count, but I missed the number. How many floors should I assume?"
             
-        elif ("threshold" in message_lower or "confidence" in message_lower) and not response["updated_params"] and ("set" in message_lower or "change" in message_lower):
+        elif "CONF" in tags and not response["updated_params"] and "EDIT" in tags:
             response["reply"] = "Manager: What confidence threshold should I use? (0.0 to 1.0)"
 
         # Fallback
@@ -291,7 +922,16 @@ OR
             str: The model's textual analysis.
         """
         if self.model and self.processor and HAS_QWEN:
-            return self._analyze_with_qwen(image_path, prompt)
+            key = (file_digest(image_path), prompt)
+            cached = self._analysis_cache.get(key)
+            if cached is not None:
+                return cached
+            output = self._analyze_with_qwen(image_path, prompt)
+            if not output.startswith("Error running Qwen-VL"):
+                self._analysis_cache[key] = output
+                if len(self._analysis_cache) > self.ANALYSIS_CACHE_SIZE:
+                    self._analysis_cache.popitem(last=False)
+            return output
 
         # Mock response for development without heavy model weights
         return f"Mock Analysis: The image contains a structural layout with columns arranged in a grid. Detected beam connections between columns."
@@ -300,31 +940,54 @@ OR
         # Implementation for Claude 3/4.5 Vision API
         pass
     
+    def _render_analysis_prompt(self, prompt: str) -> str:
+        """
+        Chat-template text for an image + prompt message. The template only emits an image
+        placeholder, never the path, so the rendered text depends on the prompt alone.
+        """
+        text = self._prompt_template_cache.get(prompt)
+        if text is None:
+            messages = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": prompt}]}]
+            text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            if len(self._prompt_template_cache) >= self.ANALYSIS_CACHE_SIZE:
+                self._prompt_template_cache.popitem(last=False)
+            self._prompt_template_cache[prompt] = text
+        return text
+
     def _analyze_with_qwen(self, image_path: str, prompt: str):
         # Implementation for Qwen-VL local inference
         try:
+            # Pass the decoded image instead of a file:// URI, repeated analyses skip the decode
+            image = _load_image(os.path.abspath(image_path), os.stat(image_path).st_mtime)
             messages = [
                 {
                     "role": "user",
                     "content": [
-                        {"type": "image", "image": f"file://{os.path.abspath(image_path)}"},
+                        {"type": "image", "image": image},
                         {"type": "text", "text": prompt}
                     ]
                 }
             ]
             
-            text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            # Only the image changes between calls with the same prompt; the processor still
+            # expands the image placeholder, since its token count depends on the image size
+            text = self._render_analysis_prompt(prompt)
             image_inputs, video_inputs = process_vision_info(messages)
+            if self.backend == "vllm":
+                return self._generate_vllm(text, max_tokens=128, image=image_inputs[0])
             inputs = self.processor(
                 text=[text],
                 images=image_inputs,
                 padding=True,
                 return_tensors="pt"
             )
+            if self.compiled:
+                inputs = self._pad_to_bucket(inputs)
             # Move inputs to same device as model
-            inputs = inputs.to(self.model.device)
+            inputs = self._to_device(inputs)
             
-            generated_ids = self.model.generate(**inputs, max_new_tokens=128)
+            with torch.inference_mode():
+                generated_ids = self.model.generate(**inputs, max_new_tokens=128, **GREEDY_GENERATION, **self._compiled_cache_kwargs())
             output_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
             
             # The output usually contains the prompt too, we might want to strip it
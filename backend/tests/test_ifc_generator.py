@@ -0,0 +1,35 @@
+import unittest
+
+import ifcopenshell
+import ifcopenshell.geom
+import ifcopenshell.util.unit
+import numpy as np
+
+from generating_unit.ifc_generator import IfcGenerator
+
+
+class IfcGeneratorUnitsTest(unittest.TestCase):
+    def _export(self, floor_count: int, height: float):
+        generator = IfcGenerator()
+        detections = {"detections": [{"bbox": [0, 0, 10, 10], "class": "column"}]}
+        generator.generate_simple_extrusion(detections, scale=0.05, height=height, floor_count=floor_count)
+        return ifcopenshell.file.from_string(generator.to_bytes().decode())
+
+    def test_project_length_unit_is_metre(self):
+        model = self._export(floor_count=1, height=3.0)
+        self.assertEqual(ifcopenshell.util.unit.calculate_unit_scale(model), 1.0)
+
+    def test_column_height_in_si_units(self):
+        model = self._export(floor_count=3, height=3.0)
+        settings = ifcopenshell.geom.settings()
+        settings.set("use-world-coords", True)
+        shape = ifcopenshell.geom.create_shape(settings, model.by_type("IfcColumn")[0])
+        # Tessellated geometry is always in SI metres, whatever the project unit
+        verts = np.array(shape.geometry.verts).reshape(-1, 3)
+        self.assertAlmostEqual(verts[:, 2].min(), 0.0, places=6)
+        self.assertAlmostEqual(verts[:, 2].max(), 9.0, places=6)
+        self.assertAlmostEqual(np.ptp(verts[:, 0]), 0.5, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from processing_unit.system_manager import SystemStatus
+from processing_unit.vision_model import VisionReasoner
+
+
+class _RecordingSystem:
+    """
+    Minimal stand-in for SystemManager that records config updates and rejects unknown keys.
+    """
+    def __init__(self):
+        self.status = SystemStatus.IDLE
+        self.logs = []
+        self.config = {}
+
+    def update_config(self, key, value):
+        if key not in ("floor_count", "conf_threshold", "generation_mode"):
+            return False
+        self.config[key] = value
+        return True
+
+
+class ChatFallbackRegexTest(unittest.TestCase):
+    def _chat(self, message: str):
+        reasoner = VisionReasoner.__new__(VisionReasoner)
+        reasoner.system = _RecordingSystem()
+        response = asyncio.run(reasoner._chat_fallback_regex(message))
+        return response, reasoner.system.config
+
+    def test_conf_value_does_not_hide_floor_count(self):
+        response, config = self._chat("conf 3 floors")
+        self.assertEqual(response["updated_params"].get("floor_count"), 3)
+        self.assertEqual(config.get("floor_count"), 3)
+
+    def test_conf_and_floor_count_both_updated(self):
+        response, config = self._chat("set confidence to 0.4 and 3 floors")
+        self.assertEqual(response["updated_params"], {"conf_threshold": 0.4, "floor_count": 3})
+        self.assertEqual(config, {"conf_threshold": 0.4, "floor_count": 3})
+
+    def test_decimal_conf_value_is_not_a_floor_count(self):
+        response, config = self._chat("threshold 0.4 floors")
+        self.assertNotIn("floor_count", response["updated_params"])
+        self.assertEqual(config, {"conf_threshold": 0.4})
+
+
+class AgentReplyTest(unittest.TestCase):
+    def _apply(self, reply: str):
+        reasoner = VisionReasoner.__new__(VisionReasoner)
+        reasoner.system = _RecordingSystem()
+        response = asyncio.run(reasoner._apply_agent_reply(reply))
+        return response, reasoner.system.config
+
+    def test_applied_key_is_reported(self):
+        response, config = self._apply('Done.\n```json\n{"action": "update_config", "key": "floor_count", "value": 5}\n```')
+        self.assertEqual(response["updated_params"], {"floor_count": 5})
+        self.assertEqual(config, {"floor_count": 5})
+
+    def test_rejected_key_is_not_reported(self):
+        response, config = self._apply('Done.\n```json\n{"action": "update_config", "key": "colour", "value": "red"}\n```')
+        self.assertEqual(response["updated_params"], {})
+        self.assertEqual(config, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
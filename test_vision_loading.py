@@ -1,7 +1,11 @@
 
+import logging
 import os
 import sys
 
+# Show the loaders' progress messages (they log through the "mcc.*" loggers)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
 # Add backend to path so we can import modules
 sys.path.append(os.path.abspath("backend"))
 
@@ -14,8 +18,9 @@ except ImportError as e:
     print(f"[FAIL] Could not import VisionReasoner: {e}")
     sys.exit(1)
 
-# Check the flags set in vision_model.py
+# Check the flags set in vision_model.py (the Qwen imports are lazy, trigger them here)
 import processing_unit.vision_model as vm
+vm._try_import_qwen()
 print(f"HAS_QWEN_CLASS: {vm.HAS_QWEN_CLASS}")
 print(f"HAS_QWEN_UTILS: {vm.HAS_QWEN_UTILS}")
 print(f"HAS_QWEN: {vm.HAS_QWEN}")
@@ -28,9 +33,12 @@ else:
 # Mock SystemManager for initialization
 class MockSystem:
     def __init__(self):
+        from processing_unit.system_manager import Config
         self.status = type('obj', (object,), {'value': 'idle'})
-        self.config = {}
+        self.config = Config()
+        self.config_version = 0
         self.logs = []
+        self.logs_version = 0
     def log(self, msg, level="INFO"):
         print(f"[MockLog] {msg}")
 